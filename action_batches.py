@@ -1,91 +1,463 @@
 #!/usr/bin/env python3
 
+import random
+import re
+import threading
 import time
 
-import requests
+from client import get_client, result, stream_list
+import metrics
+from payloads import encode
 
-base_url = 'https://api.meraki.com/api/v0'
 
+# Dashboard limits on the number of actions in a single batch
+MAX_ACTIONS = 100
+MAX_SYNC_ACTIONS = 20
 
-def create_action_batch(api_key, org_id, confirmed=False, synchronous=False, actions=None):
-    post_url = f'{base_url}/organizations/{org_id}/actionBatches'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+# Dashboard limit on the number of action batches running at once in one organization
+MAX_CONCURRENT_BATCHES = 5
+
+_batch_slots = {}
+_batch_slots_lock = threading.Lock()
+
+
+# Semaphore shared by everything submitting batches to this org, to stay within MAX_CONCURRENT_BATCHES
+def batch_slots(org_id):
+    with _batch_slots_lock:
+        return _batch_slots.setdefault(str(org_id), threading.BoundedSemaphore(MAX_CONCURRENT_BATCHES))
+
+
+# Split a list of actions into chunks that each fit within one batch
+def chunk_actions(actions, synchronous=False, size=None):
+    limit = MAX_SYNC_ACTIONS if synchronous else MAX_ACTIONS
+    size = min(size, limit) if size else limit
+    actions = list(actions)
+    return [actions[i:i + size] for i in range(0, len(actions), size)]
+
+
+# Submit actions as one batch, or as several if the list exceeds the batch limits.
+# If a journal.Journal is given, each POST is appended to it along with its response.
+# Confirmed asynchronous actions always go through run_async_batches: this returns once every batch has
+# finished, and since up to MAX_CONCURRENT_BATCHES of them run at once, their chunks are not applied in order.
+# on_batch, if given, is called with each batch as soon as it has finished, e.g. to record progress per batch.
+def create_action_batch(api_key, org_id, confirmed=False, synchronous=False, actions=None, size=None, journal=None,
+                        on_batch=None):
+    chunks = chunk_actions(actions or [], synchronous, size)
+    if confirmed and not synchronous:
+        return run_async_batches(api_key, org_id, chunks, journal, on_batch=on_batch)
+    if len(chunks) <= 1:
+        (ok, data) = post_action_batch(api_key, org_id, confirmed, synchronous, chunks[0] if chunks else actions, journal)
+        if ok and synchronous and on_batch:
+            on_batch(data)
+        return (ok, data)
+    else:
+        return create_action_batches(api_key, org_id, confirmed, synchronous, chunks, journal, on_batch)
+
+
+# POST a single action batch, without any splitting
+def post_action_batch(api_key, org_id, confirmed=False, synchronous=False, actions=None, journal=None):
+    (ok, data, throttled) = _post_action_batch(api_key, org_id, confirmed, synchronous, actions, journal)
+    return (ok, data)
+
+
+# post_action_batch, also returning how many 429s the POST got
+def _post_action_batch(api_key, org_id, confirmed, synchronous, actions, journal):
+    post_url = f'/organizations/{org_id}/actionBatches'
 
     payload = {
         'confirmed': confirmed,
         'synchronous': synchronous,
         'actions': actions,
     }
+    body = encode(payload)
+
+    started = time.time()
+    response = get_client(api_key).post(post_url, data=body)
+    (ok, data) = result(response)
+    if journal:
+        journal.record(org_id, body, ok, data, started, response.elapsed.total_seconds())
+    if metrics.enabled and ok:
+        metrics.batch_submitted(data, len(actions), synchronous, started)
+    return (ok, data, response.retries + (response.status_code == 429))
+
+
+# Submit pre-split chunks of actions one after another, returning one combined result.
+# Submission stops at the first rejected POST, or the first failed synchronous batch,
+# since later chunks may depend on resources created by earlier ones.
+# Confirmed asynchronous chunks go through run_async_batches instead, which doesn't keep their order.
+def create_action_batches(api_key, org_id, confirmed, synchronous, chunks, journal=None, on_batch=None):
+    if confirmed and not synchronous:
+        return run_async_batches(api_key, org_id, chunks, journal, on_batch=on_batch)
+    batches = []
+    errors = []
+    for chunk in chunks:
+        (ok, data) = post_action_batch(api_key, org_id, confirmed, synchronous, chunk, journal)
+        if not ok:
+            errors.append(data)
+            break
+        batches.append(data)
+        if synchronous and on_batch:
+            on_batch(data)
+        if synchronous and data['status']['failed']:
+            break
+    combined = combine_batches(batches, confirmed, synchronous)
+    combined['status']['errors'].extend(errors)
+    combined['status']['failed'] = combined['status']['failed'] or bool(errors)
+    return (not errors, combined)
+
+
+# Run chunks of actions as confirmed asynchronous batches, each holding one of the org's batch slots until
+# it finishes. When every slot is taken, our own batches are polled with backoff until one frees up.
+# Up to MAX_CONCURRENT_BATCHES chunks run at once, so a chunk must not depend on an earlier one.
+# Submission stops at the first rejected POST, but batches already accepted are still waited for,
+# so the combined result covers everything the server applied. on_start, if given, is called once the
+# first batch holds its slot, just before it is posted, and on_batch with each batch as it finishes.
+def run_async_batches(api_key, org_id, chunks, journal=None, interval=1, max_interval=30, on_start=None, on_batch=None):
+    slots = batch_slots(org_id)
+    todo = list(chunks)
+    pending = {}  # str(batch ID) -> batch ID
+    submitted = []
+    finished = {}
+    errors = []
+    delays = backoff_delays(interval, max_interval)
+
+    while (todo and not errors) or pending:
+        # Fill the free slots, only blocking for one when nothing of ours is in flight
+        while todo and not errors and slots.acquire(blocking=not pending):
+            if on_start and not submitted:
+                on_start()
+            (ok, data) = post_action_batch(api_key, org_id, True, False, todo.pop(0), journal)
+            if not ok:
+                slots.release()
+                errors.append(data)
+            else:
+                pending[str(data['id'])] = data['id']
+                submitted.append(data['id'])
+        if not pending:
+            continue
+
+        done = poll_batches(api_key, org_id, pending)
+        for (key, batch) in done.items():
+            slots.release()
+            finished[pending.pop(key)] = batch
+            if on_batch:
+                on_batch(batch)
+        if done:
+            delays = backoff_delays(interval, max_interval)
+            if todo and not errors:
+                continue  # fill the freed slots before waiting
+        if pending:
+            time.sleep(next(delays))
+
+    combined = combine_batches([finished[batch_id] for batch_id in submitted], True, False)
+    combined['status']['errors'].extend(errors)
+    combined['status']['failed'] = combined['status']['failed'] or bool(errors)
+    return (not errors, combined)
+
+
+# Errors of a batch, with any "index N" shifted by offset, to point at the action in a combined result
+def _offset_errors(errors, offset):
+    if not offset:
+        return list(errors)
+    return [_error_index.sub(lambda match: f'index {int(match.group(1)) + offset}', error) if isinstance(error, str) else error
+            for error in errors]
+
+
+# Merge several action batches into one result shaped like a single batch. Errors that name an action
+# by index are renumbered to match the combined actions.
+def combine_batches(batches, confirmed, synchronous):
+    offsets = [0]
+    for batch in batches:
+        offsets.append(offsets[-1] + len(batch.get('actions', [])))
+    return {
+        'ids': [batch['id'] for batch in batches],
+        'confirmed': confirmed,
+        'synchronous': synchronous,
+        'status': {
+            'completed': bool(batches) and all(batch['status']['completed'] for batch in batches),
+            'failed': any(batch['status']['failed'] for batch in batches),
+            'errors': [error for (batch, offset) in zip(batches, offsets)
+                       for error in _offset_errors(batch['status'].get('errors', []), offset)],
+            'createdResources': [res for batch in batches for res in batch['status'].get('createdResources', [])],
+        },
+        'actions': [action for batch in batches for action in batch.get('actions', [])],
+        'batches': batches,
+    }
+
 
-    response = requests.post(post_url, headers=headers, json=payload)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+# IDs of the batch(es) behind a result from create_action_batch
+def batch_ids(data):
+    return data['ids'] if 'ids' in data else [data['id']]
 
 
-def get_org_action_batches(api_key, org_id):
-    get_url = f'{base_url}/organizations/{org_id}/actionBatches'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+# Resources created by a finished batch (or combined batches), keyed by the index of the action that created
+# each one in data['actions']. Batches report them in submission order, one per create action, as {'id', 'uri'}.
+def created_resources(data):
+    created = {}
+    index = 0
+    for batch in data.get('batches', [data]):
+        resources = iter(batch['status'].get('createdResources') or [])
+        for action in batch.get('actions', []):
+            if action['operation'] == 'create':
+                resource = next(resources, None)
+                if resource is not None:
+                    created[index] = resource
+            index += 1
+    return created
 
-    response = requests.get(get_url, headers=headers)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+
+# With stream, data is a generator decoding batches as they arrive, optionally projected to fields
+def get_org_action_batches(api_key, org_id, stream=False, fields=None):
+    get_url = f'/organizations/{org_id}/actionBatches'
+
+    if stream:
+        return stream_list(get_client(api_key).get(get_url, stream=True), fields)
+    response = get_client(api_key).get(get_url)
+    return result(response)
 
 
 def get_action_batch(api_key, org_id, batch_id):
-    get_url = f'{base_url}/organizations/{org_id}/actionBatches/{batch_id}'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+    get_url = f'/organizations/{org_id}/actionBatches/{batch_id}'
 
-    response = requests.get(get_url, headers=headers)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+    response = get_client(api_key).get(get_url)
+    return result(response)
 
 
 def delete_action_batch(api_key, org_id, batch_id):
-    delete_url = f'{base_url}/organizations/{org_id}/actionBatches/{batch_id}'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+    delete_url = f'/organizations/{org_id}/actionBatches/{batch_id}'
 
-    response = requests.delete(delete_url, headers=headers)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+    response = get_client(api_key).delete(delete_url)
+    return result(response)
 
 
 def update_action_batch(api_key, org_id, batch_id, confirmed=False, synchronous=False):
-    put_url = f'{base_url}/organizations/{org_id}/actionBatches/{batch_id}'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+    put_url = f'/organizations/{org_id}/actionBatches/{batch_id}'
 
     payload = {
         'confirmed': confirmed,
         'synchronous': synchronous,
     }
 
-    response = requests.post(put_url, headers=headers, json=payload)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+    response = get_client(api_key).put(put_url, json=payload)
+    return result(response)
 
 
-# Helper function to check the completion status of an asynchronous action batch
-def check_status(api_key, org_id, batch_id):
-    (ok, data) = get_action_batch(api_key, org_id, batch_id)
-    if ok and data['status']['completed'] and not data['status']['failed']:
-        print(f'Action batch {batch_id} completed!')
+# Completion status of an action batch: 1 if completed, -1 if failed, 0 if still processing
+def batch_state(data):
+    if data['status']['completed'] and not data['status']['failed']:
         return 1
-    elif ok and data['status']['failed']:
-        print(f'Action batch {batch_id} failed with errors {data["status"]["errors"]}!')
+    elif data['status']['failed']:
         return -1
     else:
         return 0
 
 
-# Check until asynchronous action batch either completes or fails
-def check_until_completed(api_key, org_id, batch_id, print_message=False):
-    counter = 0
+# Print the outcome of a finished action batch
+def report_batch(data):
+    if batch_state(data) == 1:
+        print(f'Action batch {data["id"]} completed!')
+    elif batch_state(data) == -1:
+        print(f'Action batch {data["id"]} failed with errors {data["status"]["errors"]}!')
+
+
+# Helper function to check the completion status of an asynchronous action batch
+def check_status(api_key, org_id, batch_id):
+    (ok, data) = get_action_batch(api_key, org_id, batch_id)
+    if not ok:
+        return 0
+    report_batch(data)
+    return batch_state(data)
+
+
+# Exponentially growing delays between poll rounds, with jitter so that pollers don't synchronize
+def backoff_delays(interval=1, max_interval=30, factor=2):
     while True:
-        status = check_status(api_key, org_id, batch_id)
-        if status == 1:
-            return True
-        elif status == -1:
-            return False
-        elif print_message:
-            print(f'Action batch {batch_id} processing... ({99 - counter} bottles of beer)')
-            time.sleep(1)
-            counter += 1
+        yield random.uniform(interval / 2, interval)
+        interval = min(interval * factor, max_interval)
+
+
+# One poll round over the pending batches, returning the ones that have finished.
+# A single batch is fetched directly, several with one org-wide listing.
+def poll_batches(api_key, org_id, pending):
+    if len(pending) == 1:
+        (ok, data) = get_action_batch(api_key, org_id, next(iter(pending)))
+        batches = [data] if ok else []
+    else:
+        # Streamed, so that only the pending batches of a long history are kept
+        (ok, data) = get_org_action_batches(api_key, org_id, stream=True)
+        batches = data if ok else []
+    finished = {str(batch['id']): batch for batch in batches if str(batch['id']) in pending and batch_state(batch) != 0}
+    if metrics.enabled:
+        for batch in finished.values():
+            metrics.batch_finished(batch)
+    return finished
+
+
+# Wait for the given action batches to complete or fail, polling with backoff until timeout seconds pass.
+# Returns a dict of batch ID to its final batch data; batches still processing at the deadline are left out.
+def wait_for_batches(api_key, org_id, batch_ids, timeout=None, interval=1, max_interval=30, print_message=False):
+    pending = {str(batch_id): batch_id for batch_id in batch_ids}
+    finished = {}
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    delays = backoff_delays(interval, max_interval)
+    while pending:
+        for (key, batch) in poll_batches(api_key, org_id, pending).items():
+            finished[pending.pop(key)] = batch
+        if not pending:
+            break
+        delay = next(delays)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            delay = min(delay, remaining)
+        if print_message:
+            print(f'Action batch(es) {", ".join(pending)} processing, checking again in {delay:.1f}s...')
+        time.sleep(delay)
+    return finished
+
+
+# Check until asynchronous action batch either completes or fails (or the optional timeout passes)
+def check_until_completed(api_key, org_id, batch_id, print_message=False, timeout=None):
+    finished = wait_for_batches(api_key, org_id, [batch_id], timeout, print_message=print_message)
+    if batch_id not in finished:
+        return False
+    report_batch(finished[batch_id])
+    return batch_state(finished[batch_id]) == 1
+
+
+_error_index = re.compile(r'\bindex (\d+)')
+
+
+# Indexes of the actions that a failed batch's errors blame, e.g. "Action at index 3 failed: ..."
+def failed_indexes(data, count):
+    errors = data['status'].get('errors', []) if isinstance(data, dict) else [data]
+    return sorted({int(index) for error in errors for index in _error_index.findall(str(error)) if int(index) < count})
+
+
+# Submit actions, isolating any that fail instead of losing the whole batch to them. A failed batch's
+# actions are resubmitted without the ones its errors point at by index or, when the errors don't say,
+# split in half and retried, down to single actions. Good actions keep their relative order.
+# A rejected POST (a 5xx, 429s past the retries, the concurrent batch limit) never ran, so nothing in it
+# is to blame: submission stops there, as in create_action_batches, and the rejection is returned as-is.
+# Returns (ok, data) shaped like create_action_batch's combined result, plus data['poisoned']: a list of
+# {'index', 'action', 'errors'} for each action that couldn't be applied, index being its position in actions,
+# and data['rejected']: the rejected POST's response, if any.
+def submit_isolating(api_key, org_id, actions, synchronous=True, size=None, journal=None):
+    batches = []
+    poisoned = []
+    rejected = []
+
+    def submit(pairs):
+        if rejected:
+            return
+        (ok, data) = post_action_batch(api_key, org_id, True, synchronous, [action for (index, action) in pairs], journal)
+        if not ok:
+            rejected.append(data)
+            return
+        if not synchronous:
+            data = wait_for_batches(api_key, org_id, [data['id']]).get(data['id'], data)
+        if batch_state(data) == 1:
+            batches.append(data)
+            return
+        blamed = failed_indexes(data, len(pairs))
+        errors = data['status']['errors']
+        if blamed:
+            for i in blamed:
+                own = [error for error in errors if str(i) in _error_index.findall(str(error))]
+                poisoned.append({'index': pairs[i][0], 'action': pairs[i][1], 'errors': own})
+            rest = [pair for (i, pair) in enumerate(pairs) if i not in blamed]
+            if rest:
+                submit(rest)
+        elif len(pairs) == 1:
+            poisoned.append({'index': pairs[0][0], 'action': pairs[0][1], 'errors': errors})
+        else:
+            middle = len(pairs) // 2
+            submit(pairs[:middle])
+            submit(pairs[middle:])
+
+    for chunk in chunk_actions(list(enumerate(actions or [])), synchronous, size):
+        submit(chunk)
+    combined = combine_batches(batches, True, synchronous)
+    combined['status']['completed'] = not (poisoned or rejected)
+    combined['status']['failed'] = bool(poisoned or rejected)
+    combined['status']['errors'] = [error for entry in poisoned for error in entry['errors']] + rejected
+    combined['poisoned'] = sorted(poisoned, key=lambda entry: entry['index'])
+    combined['rejected'] = rejected[0] if rejected else None
+    return (not (poisoned or rejected), combined)
+
+
+# Submit actions with the batch size and synchronous/asynchronous mode chosen by a batch_tuner.BatchTuner,
+# feeding each batch's outcome back to it. Asynchronous batches overlap, each holding one of the org's batch
+# slots until it finishes, while a synchronous batch first waits for them, so it still runs after the actions
+# before it. Every batch is finished by the time this returns (ok, data), like a synchronous create_action_batch.
+# As in create_action_batches, submission stops at the first rejected POST or failed batch.
+# on_start and on_batch are called as in run_async_batches.
+def submit_tuned(api_key, org_id, actions, tuner, journal=None, interval=1, max_interval=30, on_start=None, on_batch=None):
+    actions = list(actions or [])
+    slots = batch_slots(org_id)
+    pending = {}  # str(batch ID) -> (batch ID, actions, submission time, 429s)
+    submitted = []
+    finished = {}
+    errors = []
+    failed = False
+    delays = backoff_delays(interval, max_interval)
+
+    def finish(batch_id, batch, count, synchronous, started, throttled):
+        nonlocal failed
+        finished[batch_id] = batch
+        failed = failed or batch_state(batch) != 1
+        tuner.observe(count, synchronous, time.monotonic() - started, batch_state(batch) != 1, throttled)
+        if on_batch:
+            on_batch(batch)
+
+    # Poll our asynchronous batches once, freeing the slots of finished ones, or back off if none finished
+    def poll():
+        nonlocal delays
+        done = poll_batches(api_key, org_id, {key: entry[0] for (key, entry) in pending.items()})
+        for (key, batch) in done.items():
+            slots.release()
+            (batch_id, count, started, throttled) = pending.pop(key)
+            finish(batch_id, batch, count, False, started, throttled)
+        if done:
+            delays = backoff_delays(interval, max_interval)
+        else:
+            time.sleep(next(delays))
+
+    while actions and not (errors or failed):
+        # Take a slot, only blocking for one when nothing of ours is in flight
+        while not slots.acquire(blocking=not pending):
+            poll()
+        if on_start and not submitted:
+            on_start()
+        synchronous = tuner.synchronous
+        while synchronous and pending and not failed:
+            poll()
+        if failed:
+            slots.release()
+            tuner.skip(synchronous)
+            break
+
+        size = tuner.size(synchronous)
+        (chunk, actions) = (actions[:size], actions[size:])
+        started = time.monotonic()
+        (ok, data, throttled) = _post_action_batch(api_key, org_id, True, synchronous, chunk, journal)
+        if not ok:
+            slots.release()
+            tuner.observe(len(chunk), synchronous, time.monotonic() - started, True, throttled)
+            errors.append(data)
+        elif synchronous:
+            slots.release()
+            submitted.append(data['id'])
+            finish(data['id'], data, len(chunk), True, started, throttled)
+        else:
+            submitted.append(data['id'])
+            pending[str(data['id'])] = (data['id'], len(chunk), started, throttled)
+    while pending:
+        poll()
+
+    batches = [finished[batch_id] for batch_id in submitted]
+    combined = combine_batches(batches, True, all(batch['synchronous'] for batch in batches))
+    combined['status']['errors'].extend(errors)
+    combined['status']['failed'] = combined['status']['failed'] or bool(errors)
+    return (not errors, combined)
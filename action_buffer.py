@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import json
+
+from payloads import RawJSON
+
+
+# Merge update bodies: nested dicts are merged key by key, anything else is replaced by the later value
+def merge_bodies(earlier, later):
+    merged = dict(earlier)
+    for (key, value) in later.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_bodies(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _fingerprint(body):
+    if isinstance(body, RawJSON):
+        return body
+    return json.dumps(body, sort_keys=True, default=repr)
+
+
+# Drop-in replacement for the plain lists the batch helpers append to, which keeps batches minimal:
+# - repeated updates to the same resource are merged into the first one, with their bodies combined
+# - exact duplicates of an action are dropped
+# - a create or destroy of a resource starts a fresh run for it, so nothing is merged across it
+#   and the relative order of creates, destroys and updates is preserved
+class ActionBuffer:
+    def __init__(self, actions=()):
+        self.actions = []
+        self._updates = {}  # resource -> index of its pending update action
+        self._seen = {}  # resource -> {(operation, body fingerprint)} since its last create/destroy
+        self.merged = 0
+        self.dropped = 0
+        self.extend(actions)
+
+    def append(self, action):
+        resource = action['resource']
+        operation = action['operation']
+        body = action.get('body') or {}
+
+        if operation == 'update' and resource in self._updates:
+            index = self._updates[resource]
+            earlier = self.actions[index]
+            if isinstance(body, RawJSON):
+                body = body.value
+            self.actions[index] = dict(earlier, body=merge_bodies(earlier['body'], body))
+            self.merged += 1
+            return
+
+        key = (operation, _fingerprint(body))
+        seen = self._seen.setdefault(resource, set())
+        if key in seen:
+            self.dropped += 1
+            return
+
+        if operation in ('create', 'destroy'):
+            self._updates.pop(resource, None)
+            seen.clear()
+        elif operation == 'update':
+            body = body.value if isinstance(body, RawJSON) else body
+            action = dict(action, body=body)
+            self._updates[resource] = len(self.actions)
+        seen.add(key)
+        self.actions.append(action)
+
+    def extend(self, actions):
+        for action in actions:
+            self.append(action)
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __getitem__(self, index):
+        return self.actions[index]
+
+    def __repr__(self):
+        return f'ActionBuffer({len(self.actions)} actions, {self.merged} merged, {self.dropped} dropped)'
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# asyncio versions of the functions in action_batches.py, returning the same (ok, data) tuples.
+# The blocking calls run on a shared thread pool over the pooled client, so many batches
+# (e.g. one per site) can be in flight at once on one event loop.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+import action_batches
+import client
+
+# Maximum number of API calls running at the same time; defaults to the connection pool size
+max_workers = None
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_workers or client.pool_size, thread_name_prefix='action-batches')
+    return _executor
+
+
+async def _run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def create_action_batch(api_key, org_id, confirmed=False, synchronous=False, actions=None, size=None, journal=None):
+    return await _run(action_batches.create_action_batch, api_key, org_id, confirmed, synchronous, actions, size, journal)
+
+
+async def get_org_action_batches(api_key, org_id):
+    return await _run(action_batches.get_org_action_batches, api_key, org_id)
+
+
+async def get_action_batch(api_key, org_id, batch_id):
+    return await _run(action_batches.get_action_batch, api_key, org_id, batch_id)
+
+
+async def delete_action_batch(api_key, org_id, batch_id):
+    return await _run(action_batches.delete_action_batch, api_key, org_id, batch_id)
+
+
+async def update_action_batch(api_key, org_id, batch_id, confirmed=False, synchronous=False):
+    return await _run(action_batches.update_action_batch, api_key, org_id, batch_id, confirmed, synchronous)
+
+
+# Helper function to check the completion status of an asynchronous action batch
+async def check_status(api_key, org_id, batch_id):
+    return await _run(action_batches.check_status, api_key, org_id, batch_id)
+
+
+# Wait for the given action batches to complete or fail, like action_batches.wait_for_batches,
+# yielding to other tasks between poll rounds
+async def wait_for_batches(api_key, org_id, batch_ids, timeout=None, interval=1, max_interval=30):
+    pending = {str(batch_id): batch_id for batch_id in batch_ids}
+    finished = {}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    delays = action_batches.backoff_delays(interval, max_interval)
+    while pending:
+        for (key, batch) in (await _run(action_batches.poll_batches, api_key, org_id, set(pending))).items():
+            finished[pending.pop(key)] = batch
+        if not pending:
+            break
+        delay = next(delays)
+        if deadline is not None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            delay = min(delay, remaining)
+        await asyncio.sleep(delay)
+    return finished
+
+
+# Check until asynchronous action batch either completes or fails (or the optional timeout passes)
+async def check_until_completed(api_key, org_id, batch_id, timeout=None):
+    finished = await wait_for_batches(api_key, org_id, [batch_id], timeout)
+    if batch_id not in finished:
+        return False
+    action_batches.report_batch(finished[batch_id])
+    return action_batches.batch_state(finished[batch_id]) == 1
+
+
+# Submit a batch and, if asynchronous, wait for every resulting batch to finish
+# (create_action_batch already waits for confirmed asynchronous batches)
+async def create_and_wait(api_key, org_id, actions, confirmed=True, synchronous=False, size=None, journal=None):
+    (ok, data) = await create_action_batch(api_key, org_id, confirmed, synchronous, actions, size, journal)
+    if ok and confirmed and not synchronous:
+        ok = all(action_batches.batch_state(batch) == 1 for batch in data['batches'])
+    return (ok, data)
+
+
+# Close the shared thread pool
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Adaptive choice of actions per batch and synchronous vs asynchronous submission, from what a run observes.
+#
+# Batch size follows AIMD: it grows by step after each clean batch and is cut by decrease after a failed
+# or throttled (429) one, or one slower than max_latency. The mode with the better smoothed throughput
+# (actions per second, from submission to completion) is used, and the other one is tried again every
+# explore batches so that a change in conditions is noticed.
+
+import threading
+
+from action_batches import MAX_ACTIONS, MAX_SYNC_ACTIONS
+
+
+class BatchTuner:
+    def __init__(self, min_size=5, max_size=MAX_ACTIONS, size=MAX_SYNC_ACTIONS, modes=(True, False), step=5,
+                 decrease=0.5, max_latency=None, explore=50, smoothing=0.3):
+        self.min_size = min_size
+        self.max_size = min(max_size, MAX_ACTIONS)
+        self.modes = tuple(modes)  # which of synchronous (True) / asynchronous (False) may be chosen
+        self.step = step
+        self.decrease = decrease
+        self.max_latency = max_latency  # seconds per batch, above which the size is cut
+        self.explore = explore
+        self.smoothing = smoothing  # weight of the newest observation in the throughput averages
+
+        self.lock = threading.Lock()
+        self._size = max(min_size, min(size, self.max_size))
+        self.throughput = {}  # mode -> smoothed actions per second
+        self.trying = set()  # untried modes handed out, awaiting their first observation
+        self.choices = 0
+        self.batches = 0
+        self.failures = 0
+        self.throttled = 0
+
+    # The mode for the next batch: untried modes first, then the faster one, with periodic exploration
+    @property
+    def synchronous(self):
+        with self.lock:
+            # Hand each untried mode to one batch only, so concurrent callers don't all pay for a slow trial
+            untried = [mode for mode in self.modes if mode not in self.throughput and mode not in self.trying]
+            if untried:
+                self.trying.add(untried[0])
+                return untried[0]
+            measured = [mode for mode in self.modes if mode in self.throughput]
+            if not measured:
+                return self.modes[0]
+            best = max(measured, key=lambda mode: self.throughput[mode])
+            self.choices += 1
+            if len(measured) > 1 and self.explore and self.choices % self.explore == 0:
+                return not best
+            return best
+
+    # Hand back a mode from synchronous that ended up not being used, so an untried one is offered again
+    def skip(self, synchronous):
+        with self.lock:
+            self.trying.discard(synchronous)
+
+    # Actions for the next batch in the given mode, within the bounds and the Dashboard's limits
+    def size(self, synchronous):
+        with self.lock:
+            limit = MAX_SYNC_ACTIONS if synchronous else MAX_ACTIONS
+            return max(1, min(int(self._size), limit))
+
+    # Feed back one finished batch: its action count, mode, seconds from submission to completion,
+    # whether it failed, and how many 429s its requests got
+    def observe(self, actions, synchronous, seconds, failed=False, throttled=0):
+        with self.lock:
+            self.batches += 1
+            self.failures += bool(failed)
+            self.throttled += throttled
+            if failed or throttled or (self.max_latency and seconds > self.max_latency):
+                self._size = max(self.min_size, self._size * self.decrease)
+            else:
+                self._size = min(self.max_size, self._size + self.step)
+            self.trying.discard(synchronous)
+            if not failed and seconds > 0:
+                rate = actions / seconds
+                previous = self.throughput.get(synchronous)
+                self.throughput[synchronous] = rate if previous is None else (
+                    self.smoothing * rate + (1 - self.smoothing) * previous)
+
+    def __repr__(self):
+        rates = ', '.join(f'{"sync" if mode else "async"} {rate:.1f}/s' for (mode, rate) in self.throughput.items())
+        return f'BatchTuner(size {int(self._size)}, {rates or "no data"}, {self.batches} batches, {self.failures} failed, {self.throttled} throttled)'
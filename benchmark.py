@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+# End-to-end throughput benchmark of the provisioning phases, run against fake_dashboard.py.
+#
+#   python benchmark.py                        # networks, devices & settings for 10, 1k and 10k sites
+#   python benchmark.py --sites 1000 --sweep   # also sweep batch size, sync/async and concurrency
+#   python benchmark.py --metrics metrics.prom # also export per-endpoint latency, retries, bytes and batch timings
+#
+# The stand-in server runs in a child process, so peak memory covers the client side only. It is the process's
+# peak resident size so far (ru_maxrss), read without profiling so that the timings aren't slowed down.
+
+import argparse
+import json
+import multiprocessing
+import resource
+import statistics
+import sys
+import threading
+import time
+
+import client
+import metrics
+import rate_limit
+from action_batches import batch_ids
+from batch_tuner import BatchTuner
+from dashboard import get_networks
+from demo import add_devices, build_settings
+from fake_dashboard import FakeDashboard
+from network_index import NetworkIndex
+from payloads import encode
+from pipeline import run_settings
+from sites import Inventory, Site
+
+api_key = 'benchmark'
+org_id = '1'
+
+
+# An inventory of n sites, each with a full set of devices
+def synthetic_inventory(n):
+    sites = []
+    for i in range(n):
+        (a, b) = divmod(i, 250)
+        sites.append(Site(
+            str(i),
+            f'Site {i}, BM',
+            f'Q2MX-{i:04X}-BNCH',
+            f'Q2MS-{i:04X}-BNCH',
+            f'Q2MR-{i:04X}-BNCH',
+            f'Q2MV-{i:04X}-BNCH',
+            f'10.{a}.{b}.2',
+            f'10.{a}.{b}.3',
+            i % 4000 + 1,
+            f'{i} Benchmark Way',
+        ))
+    return Inventory(sites)
+
+
+def _serve(queue, options):
+    dashboard = FakeDashboard(**options)
+    queue.put(dashboard.base_url)
+    dashboard.server.serve_forever()
+
+
+# Start a fresh stand-in server in a child process, returning (process, base_url)
+def start_server(**options):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(queue, options), daemon=True)
+    process.start()
+    return (process, queue.get(timeout=30))
+
+
+# Peak resident memory of this process so far, in MiB (ru_maxrss is in KiB on Linux, bytes on macOS)
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+# Submit one batch per job through the settings pipeline, measuring throughput, latency, memory and payload size.
+# Latency is per job, which may span several batches (e.g. a site's settings): it runs from when the job gets
+# a batch slot until its batches finish. The time it spent built but waiting for a slot is its queue time.
+def run_phase(name, jobs, build, sites, synchronous, size, concurrency, tuner=None):
+    queued = {}
+    started = {}
+    latencies = []
+    queue_times = []
+    stats = {'actions': 0, 'batches': 0, 'bytes': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def timed_build(job):
+        actions = build(job)
+        payload = len(encode({'confirmed': True, 'synchronous': synchronous, 'actions': list(actions)}))
+        with lock:
+            stats['actions'] += len(actions)
+            stats['bytes'] += payload
+            queued[id(job)] = time.perf_counter()
+        return actions
+
+    def start(job):
+        with lock:
+            started[id(job)] = time.perf_counter()
+
+    begin = time.perf_counter()
+    for (job, ok, data) in run_settings(api_key, org_id, jobs, timed_build, concurrency, synchronous, size, tuner=tuner,
+                                        on_start=start):
+        begun = started.get(id(job), queued[id(job)])
+        latencies.append(time.perf_counter() - begun)
+        queue_times.append(begun - queued[id(job)])
+        if ok:
+            stats['batches'] += len(batch_ids(data))
+            stats['failed'] += bool(data['status']['failed'])
+        else:
+            stats['failed'] += 1
+    elapsed = time.perf_counter() - begin
+
+    return {
+        'phase': name,
+        'sites': sites,
+        'mode': 'auto' if tuner else 'sync' if synchronous else 'async',
+        'size': size,
+        'concurrency': concurrency,
+        'actions': stats['actions'],
+        'batches': stats['batches'],
+        'failed': stats['failed'],
+        'seconds': round(elapsed, 3),
+        'actions_per_sec': round(stats['actions'] / elapsed, 1) if elapsed else 0,
+        'batches_per_sec': round(stats['batches'] / elapsed, 2) if elapsed else 0,
+        'p50_job_latency': round(percentile(latencies, 50), 4),
+        'p99_job_latency': round(percentile(latencies, 99), 4),
+        'mean_job_latency': round(statistics.mean(latencies), 4) if latencies else 0,
+        'p50_queue': round(percentile(queue_times, 50), 4),
+        'p99_queue': round(percentile(queue_times, 99), 4),
+        'peak_mib': round(peak_rss_mib(), 2),
+        'payload_bytes': stats['bytes'],
+    }
+
+
+def chunks(actions, size):
+    return [actions[i:i + size] for i in range(0, len(actions), size)]
+
+
+# Run the networks, devices and settings phases for one inventory, against a fresh server
+def run_provisioning(inventory, args, synchronous=None, size=None, concurrency=None, tuner=None):
+    (process, url) = start_server(latency=args.latency, batch_delay=args.batch_delay, rate=args.server_rate, burst=args.server_rate or 10)
+    client.close_clients()
+    client.configure(url=url)
+    results = []
+    try:
+        # Networks, one create action per site
+        actions = [{'resource': f'/organizations/{org_id}/networks', 'operation': 'create',
+                    'body': {'name': site.net_name, 'type': 'appliance switch wireless camera', 'tags': 'benchmark'}} for site in inventory]
+        sync = True if synchronous is None else synchronous
+        results.append(run_phase('networks', chunks(actions, size or 20), lambda chunk: chunk, len(inventory), sync, size, concurrency, tuner))
+
+        (ok, networks) = get_networks(api_key, org_id, per_page=1000)
+        index = NetworkIndex(networks)
+        net_data = [{'net_id': index.named(site.net_name)[0]['id'], 'site': site.site, 'location': site.location} for site in inventory]
+
+        # Devices, one claim action per serial
+        actions = []
+        for (net, site) in zip(net_data, inventory):
+            for serial in site.serials:
+                add_devices(actions, net['net_id'], serial)
+        sync = False if synchronous is None else synchronous
+        results.append(run_phase('devices', chunks(actions, size or 100), lambda chunk: chunk, len(inventory), sync, size, concurrency, tuner))
+
+        # Settings, one batch (split as needed) per site
+        sync = True if synchronous is None else synchronous
+        jobs = list(zip(net_data, inventory))
+        results.append(run_phase('settings', jobs, lambda job: build_settings(job[0], job[1], 'benchmark', ['bench']),
+                                 len(inventory), sync, size, concurrency, tuner))
+    finally:
+        process.terminate()
+        process.join()
+    return results
+
+
+def print_table(results):
+    columns = ['phase', 'sites', 'mode', 'size', 'concurrency', 'actions', 'batches', 'failed', 'seconds',
+               'actions_per_sec', 'batches_per_sec', 'p50_job_latency', 'p99_job_latency', 'p50_queue', 'peak_mib', 'payload_bytes']
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print('  '.join(column.rjust(width) for (column, width) in zip(columns, widths)))
+    for result in results:
+        print('  '.join(str(result[column]).rjust(width) for (column, width) in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the provisioning phases against a local stand-in API')
+    parser.add_argument('--sites', type=int, nargs='+', default=[10, 1000, 10000], help='inventory sizes to run')
+    parser.add_argument('--concurrency', type=int, default=10, help='sites/batches in flight at once')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds of server latency per request')
+    parser.add_argument('--batch-delay', type=float, default=0.2, help='seconds for an asynchronous batch to finish')
+    parser.add_argument('--server-rate', type=float, default=0, help='server requests/s per org before 429s, 0 to disable')
+    parser.add_argument('--client-rate', type=float, default=1000, help='client-side requests/s per org')
+    parser.add_argument('--sweep', action='store_true', help='also sweep batch size, sync/async and concurrency')
+    parser.add_argument('--sweep-sizes', type=int, nargs='+', default=[10, 20, 50, 100])
+    parser.add_argument('--sweep-concurrency', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--tune', action='store_true', help='also run each inventory with auto-tuned batch size and mode')
+    parser.add_argument('--json', help='also write results to this file')
+    parser.add_argument('--metrics', help='also write per-endpoint metrics to this file (.prom for Prometheus text, else JSON)')
+    args = parser.parse_args()
+
+    metrics.enable(bool(args.metrics))
+
+    rate_limit.rate = args.client_rate
+    rate_limit.burst = args.client_rate
+
+    results = []
+    for n in args.sites:
+        results.extend(run_provisioning(synthetic_inventory(n), args, concurrency=args.concurrency))
+        if args.tune:
+            results.extend(run_provisioning(synthetic_inventory(n), args, concurrency=args.concurrency, tuner=BatchTuner()))
+        print_table(results[-6 if args.tune else -3:])
+        print()
+
+    if args.sweep:
+        inventory = synthetic_inventory(min(args.sites))
+        for synchronous in (True, False):
+            for size in args.sweep_sizes:
+                if synchronous and size > 20:
+                    continue
+                for concurrency in args.sweep_concurrency:
+                    results.extend(run_provisioning(inventory, args, synchronous, size, concurrency))
+        print_table(results)
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2)
+    if args.metrics:
+        metrics.write(args.metrics)
+
+
+if __name__ == '__main__':
+    main()
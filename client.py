@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from json_stream import iter_array
+import metrics
+import rate_limit
+import response_cache
+
+# Override with the MERAKI_BASE_URL environment variable or configure(url=...), e.g. to use fake_dashboard.py
+base_url = os.environ.get('MERAKI_BASE_URL', 'https://api.meraki.com/api/v0')
+
+# Defaults applied to every client created by get_client
+pool_size = 10
+timeout = (5, 60)  # (connect, read) seconds
+max_retries = 5  # retries of a request throttled with 429
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# One pooled, keep-alive session for a given API key and base URL
+class DashboardClient:
+    def __init__(self, api_key, base_url=base_url, pool_size=pool_size, timeout=timeout, max_retries=max_retries):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        self.session.headers.update({'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # Accepts either a path relative to base_url, or a full URL
+    def url(self, path):
+        return path if '://' in path else f'{self.base_url}{path}'
+
+    # Send a request within the org's rate limit, retrying 429 responses after the server's Retry-After
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.url(path)
+        limiter = rate_limit.limiter_for(url, self.api_key)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            started = time.perf_counter() if metrics.enabled else 0
+            response = self.session.request(method, url, **kwargs)
+            retry = response.status_code == 429 and attempt < self.max_retries
+            if metrics.enabled:
+                metrics.record_request(method, url, response, time.perf_counter() - started, retry, kwargs.get('stream', False))
+            if not retry:
+                if method != 'GET' and response_cache.cache is not None:
+                    response_cache.cache.invalidate(self.api_key, url)
+                response.retries = attempt  # 429s retried before this response
+                return response
+            limiter.pause(rate_limit.retry_after(response, attempt))
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    # GET through the response cache when one is enabled, revalidating expired entries where possible
+    def cached_get(self, path, params=None, **kwargs):
+        cache = response_cache.cache
+        if cache is None:
+            return self.get(path, params=params, **kwargs)
+        url = self.url(path)
+        key = (self.api_key, f'{url}?{urlencode(sorted(params.items()))}' if params else url)
+        entry = cache.get(key)
+        if entry is not None and entry.fresh:
+            cache.hits += 1
+            return entry.response
+        headers = dict(kwargs.pop('headers', None) or {}, **(entry.validators() if entry else {}))
+        response = self.get(url, params=params, headers=headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            cache.refresh(key)
+            cache.revalidated += 1
+            return entry.response
+        cache.misses += 1
+        if response.ok:
+            cache.put(key, response)
+        return response
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+# Return the shared client for this API key and base URL, creating it on first use
+def get_client(api_key, url=None):
+    url = (url or base_url).rstrip('/')
+    key = (api_key, url)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = DashboardClient(api_key, url, pool_size, timeout, max_retries)
+                _clients[key] = client
+    return client
+
+
+# Change the pool size, timeouts, 429 retries and/or base URL used by clients created from now on
+def configure(size=None, seconds=None, retries=None, url=None):
+    global pool_size, timeout, max_retries, base_url
+    if size is not None:
+        pool_size = size
+    if seconds is not None:
+        timeout = seconds
+    if retries is not None:
+        max_retries = retries
+    if url is not None:
+        base_url = url
+
+
+# Close and forget every shared client
+def close_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+# Convert a response into the (ok, data) tuple returned throughout this project
+def result(response):
+    if response.ok:
+        data = response.json() if response.content else None
+    else:
+        data = response.text
+    return (response.ok, data)
+
+
+# Like result, for a response requested with stream=True: on success, data is a generator of the
+# items of its JSON array, optionally projected to the given fields
+def stream_list(response, fields=None):
+    if not response.ok:
+        return result(response)
+    return (True, iter_array(response, fields))
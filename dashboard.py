@@ -2,52 +2,83 @@
 
 import requests
 
-base_url = 'https://api.meraki.com/api/v0'
+from client import get_client, result, stream_list
+from json_stream import iter_array, project
+from rate_limit import bind_device, bind_network
 
 
 # List the organizations that the user has privileges on
 # https://api.meraki.com/api_docs#list-the-organizations-that-the-user-has-privileges-on
-def get_user_orgs(api_key):
-    get_url = f'{base_url}/organizations'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+# With stream, data is a generator decoding organizations as they arrive, optionally projected to fields.
+def get_user_orgs(api_key, stream=False, fields=None):
+    get_url = '/organizations'
 
-    response = requests.get(get_url, headers=headers)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+    if stream:
+        return stream_list(get_client(api_key).get(get_url, stream=True), fields)
+    response = get_client(api_key).cached_get(get_url)
+    return result(response)
 
 
 # List the networks in an organization
 # https://api.meraki.com/api_docs#list-the-networks-in-an-organization
-def get_networks(api_key, org_id, configTemplateId=None):
-    get_url = f'{base_url}/organizations/{org_id}/networks'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
-
+# With per_page, pages are fetched lazily and data is a generator of networks instead of a list;
+# a page after the first that fails raises requests.HTTPError.
+# With stream, data is also a generator, and each page is decoded network by network as it arrives.
+# fields optionally limits each network yielded to those fields, e.g. ('id', 'name', 'tags').
+def get_networks(api_key, org_id, configTemplateId=None, per_page=None, stream=False, fields=None):
+    get_url = f'/organizations/{org_id}/networks'
+
+    params = {}
     if configTemplateId:
-        get_url += f'?configTemplateId={configTemplateId}'
-
-    response = requests.get(get_url, headers=headers)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+        params['configTemplateId'] = configTemplateId
+    if per_page:
+        params['perPage'] = per_page
+
+    if stream:
+        response = get_client(api_key).get(get_url, params=params, stream=True)
+    else:
+        response = get_client(api_key).cached_get(get_url, params=params)
+    if not response.ok:
+        return result(response)
+    elif per_page or stream:
+        return (True, _network_pages(api_key, org_id, response, stream, fields))
+    else:
+        for network in response.json():
+            bind_network(network['id'], org_id)
+        return result(response)
+
+
+# Yield networks page by page, following the Link: <...>; rel=next headers
+def _network_pages(api_key, org_id, response, stream=False, fields=None):
+    while True:
+        for network in iter_array(response) if stream else response.json():
+            bind_network(network['id'], org_id)
+            yield project(network, fields)
+        next_page = response.links.get('next', {}).get('url')
+        if not next_page:
+            return
+        if stream:
+            response = get_client(api_key).get(next_page, stream=True)
+        else:
+            response = get_client(api_key).cached_get(next_page)
+        response.raise_for_status()
 
 
 # Enable/Disable VLANs for the given network
 # https://api.meraki.com/api_docs#enable/disable-vlans-for-the-given-network
 def enable_vlans(api_key, net_id, enabled=True):
-    put_url = f'{base_url}/networks/{net_id}/vlansEnabledState'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+    put_url = f'/networks/{net_id}/vlansEnabledState'
 
     payload = {'enabled': enabled}
 
-    response = requests.put(put_url, headers=headers, json=payload)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+    response = get_client(api_key).put(put_url, json=payload)
+    return result(response)
 
 
 # Create a network
 # https://api.meraki.com/api_docs#create-a-network
 def create_network(api_key, org_id, name, net_type='wireless', tags='', copyFromNetworkId=None, timeZone='America/Los_Angeles'):
-    post_url = f'{base_url}/organizations/{org_id}/networks'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+    post_url = f'/organizations/{org_id}/networks'
 
     if tags and type(tags) == list:
         tags = ' '.join(tags)
@@ -57,47 +88,92 @@ def create_network(api_key, org_id, name, net_type='wireless', tags='', copyFrom
     payload = dict((k, vars[k]) for k in params)
     payload['type'] = net_type
 
-    response = requests.post(post_url, headers=headers, json=payload)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+    response = get_client(api_key).post(post_url, json=payload)
+    if response.ok:
+        bind_network(response.json()['id'], org_id)
+    return result(response)
 
 
 # Delete a network
 # https://api.meraki.com/api_docs#delete-a-network
 def delete_network(api_key, net_id):
-    delete_url = f'{base_url}/networks/{net_id}'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+    delete_url = f'/networks/{net_id}'
 
-    response = requests.delete(delete_url, headers=headers)
+    response = get_client(api_key).delete(delete_url)
     return response.ok
 
 
+# List the devices in an organization
+# https://api.meraki.com/api_docs#list-the-devices-in-an-organization
+def get_org_devices(api_key, org_id):
+    get_url = f'/organizations/{org_id}/devices'
+
+    response = get_client(api_key).cached_get(get_url)
+    if response.ok:
+        for device in response.json():
+            bind_device(device['serial'], org_id)
+    return result(response)
+
+
+# Return the management interface settings for a device
+# https://api.meraki.com/api_docs#return-the-management-interface-settings-for-a-device
+def get_management_interface(api_key, net_id, serial):
+    get_url = f'/networks/{net_id}/devices/{serial}/managementInterfaceSettings'
+
+    response = get_client(api_key).cached_get(get_url)
+    return result(response)
+
+
+# List the VLANs for an MX network
+# https://api.meraki.com/api_docs#list-the-vlans-for-an-mx-network
+def get_vlans(api_key, net_id):
+    get_url = f'/networks/{net_id}/vlans'
+
+    response = get_client(api_key).cached_get(get_url)
+    return result(response)
+
+
+# List the group policies in a network
+# https://api.meraki.com/api_docs#list-the-group-policies-in-a-network
+def get_group_policies(api_key, net_id):
+    get_url = f'/networks/{net_id}/groupPolicies'
+
+    response = get_client(api_key).cached_get(get_url)
+    return result(response)
+
+
+# List the switch ports for a switch
+# https://api.meraki.com/api_docs#list-the-switch-ports-for-a-switch
+def get_switchports(api_key, serial):
+    get_url = f'/devices/{serial}/switchPorts'
+
+    response = get_client(api_key).cached_get(get_url)
+    return result(response)
+
+
 # Blink the LEDs on a device
 # https://api.meraki.com/api_docs#blink-the-leds-on-a-device
 def blink_device(api_key, net_id, serial, duration=20, period=160, duty=50):
-    post_url = f'{base_url}/networks/{net_id}/devices/{serial}/blinkLeds'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'}
+    post_url = f'/networks/{net_id}/devices/{serial}/blinkLeds'
 
     vars = locals()
     params = ['duration', 'period', 'duty']
     payload = dict((k, vars[k]) for k in params)
 
-    response = requests.post(post_url, headers=headers, json=payload)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+    response = get_client(api_key).post(post_url, json=payload)
+    return result(response)
 
 
 # Generate a snapshot of what the camera sees at the specified time and return a link to that image.
 # https://api.meraki.com/api_docs#generate-a-snapshot-of-what-the-camera-sees-at-the-specified-time-and-return-a-link-to-that-image
 def take_snapshot(api_key, net_id, serial, timestamp=None):
-    post_url = f'{base_url}/networks/{net_id}/cameras/{serial}/snapshot'
-    headers = {'X-Cisco-Meraki-API-Key': api_key, 'Content-Type': 'application/json'} if timestamp else {'X-Cisco-Meraki-API-Key': api_key}
+    post_url = f'/networks/{net_id}/cameras/{serial}/snapshot'
+    headers = {} if timestamp else {'Content-Type': None}
 
     payload = {'timestamp': timestamp} if timestamp else {}
 
-    response = requests.post(post_url, headers=headers, json=payload)
-    data = response.json() if response.ok else response.text
-    return (response.ok, data)
+    response = get_client(api_key).post(post_url, headers=headers, json=payload)
+    return result(response)
 
 
 # Send a message in Webex Teams
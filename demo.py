@@ -1,26 +1,57 @@
 #!/usr/bin/env python3
 
-import csv
-import json
-from json.decoder import JSONDecodeError
-import os
+import atexit
 import random
-import time
 import sys
 
 from dashboard import *
 from action_batches import *
-from group_policies import policies
+from action_buffer import ActionBuffer
+from batch_tuner import BatchTuner
+from fan_out import blink_devices, take_snapshots
+from group_policies import compiled as compiled_policies
+from journal import Journal
+import metrics
+import response_cache
+from network_index import NetworkIndex
+from pipeline import concurrency, run_settings
+from rate_limit import bind_device, bind_network
+from reconcile import LiveState, fetch_current, reconcile
+from scheduler import Scheduler
+from sites import load_inventory
+from state import StateStore
+from teardown import teardown_networks
+
+journal_path = 'action_batches.ndjson.gz'
+state_path = 'provisioning.db'
+metrics_path = 'metrics.prom'
+
+
+# Pick three tags from the custom tags and some fillers. The choice is random but stable for a given key
+# (network name, serial, switchport), so reruns produce the same bodies and --reconcile can skip them.
+def pick_tags(custom_tags, key):
+    return ' '.join(random.Random(key).sample(custom_tags + ['foo', 'bar', 'foobar', 'spam', 'ham', 'eggs'], 3))
+
+
+net_type = 'appliance switch wireless camera systemsManager'
+
+
+# Index of the org's networks by name and tag
+def network_index(api_key, org_id):
+    (ok, networks) = get_networks(api_key, org_id, per_page=1000, stream=True, fields=('id', 'name', 'tags'))
+    if not ok:
+        sys.exit(networks)
+    return NetworkIndex(networks)
 
 
-# Create networks using action batches
-def create_networks(api_key, org_id, sites, locations, custom_tags):
-    net_type = 'appliance switch wireless camera systemsManager'
-    (ok, networks) = get_networks(api_key, org_id)
-    net_names = [net['name'] for net in networks]
-    try:
-        isp_net = networks[net_names.index('ISP')]['id']
-    except ValueError:
+# Find the base "ISP" network that new networks are copied from, creating it if needed
+def get_isp_network(api_key, org_id, index=None):
+    if index is None:
+        index = network_index(api_key, org_id)
+    isp = index.named('ISP')
+    if isp:
+        isp_net = isp[0]['id']
+    else:
         (ok, data) = create_network(api_key, org_id, 'ISP', net_type)
         if not ok:
             sys.exit(data)
@@ -29,39 +60,88 @@ def create_networks(api_key, org_id, sites, locations, custom_tags):
         if not ok:
             sys.exit(data)
         print(f'Created a base network "ISP" with VLANs enabled, network ID {isp_net}!')
-
-    actions = []
+    return isp_net
+
+
+# Helper function to create a network for a site's location
+def add_network(actions, org_id, location, custom_tags, isp_net):
+    net_name = location.replace(',', ' -')
+    net_tags = pick_tags(custom_tags, net_name)
+    action = {
+        'name': net_name,
+        'type': net_type,
+        'tags': net_tags,
+        'copyFromNetworkId': isp_net
+    }
+    actions.append({
+        'resource': f'/organizations/{org_id}/networks',
+        'operation': 'create',
+        'body': action
+    })
+
+
+# Create networks using action batches, returning a dict of site to the ID of the network created for it.
+# record, if given, is called with {site: net_id} for the networks of each batch as soon as it finishes, so a crash
+# part-way only loses the batches in flight. A network already named after a site's location, e.g. one created
+# by a run that died before recording it, is taken over instead of created again.
+# If a batch fails, its errors are printed and only the sites whose networks were created are returned.
+def create_networks(api_key, org_id, sites, locations, custom_tags, journal=None, tuner=None, record=None):
+    index = network_index(api_key, org_id)
+    isp_net = get_isp_network(api_key, org_id, index)
+
+    net_ids = {}
+    pending = []
+    existing = {}
     for (site, location) in zip(sites, locations):
-        net_name = location.replace(',', ' -')
-        net_tags = ' '.join(random.sample(custom_tags + ['foo', 'bar', 'foobar', 'spam', 'ham', 'eggs'], 3))
-        action = {
-            'name': net_name,
-            'type': net_type,
-            'tags': net_tags,
-            'copyFromNetworkId': isp_net
-        }
-        actions.append({
-            'resource': f'/organizations/{org_id}/networks',
-            'operation': 'create',
-            'body': action
-        })
-
-    with open('create_networks.json', 'w') as fp:
-        payload = {
-            'confirmed': True,
-            'synchronous': True,
-            'actions': actions
-        }
-        json.dump(payload, fp)
-
-    print('POSTing one synchronous action batch to create networks, payload in create_networks.json')
-    (ok, data) = create_action_batch(api_key, org_id, True, True, actions)
-    if not ok:
-        sys.exit(data)
+        name = location.replace(',', ' -')
+        if name not in existing:
+            existing[name] = [network['id'] for network in index.named(name)]
+        if existing[name]:
+            net_ids[site] = existing[name].pop(0)
+        else:
+            pending.append((site, location))
+
+    # Read the new network IDs from each finished batch. Sites sharing a location share one create action,
+    # which only makes one network, so don't hand the same network to two of them.
+    def finished(batch):
+        new = {}
+        for (position, resource) in sorted(created_resources(batch).items()):
+            name = batch['actions'][position]['body']['name']
+            for (site, location) in pending:
+                if location.replace(',', ' -') == name:
+                    new[site] = resource['id']
+                    pending.remove((site, location))
+                    break
+        save(new)
+        if batch_state(batch) == 1:
+            print(f'Action batch {batch["id"]} completed!')
+
+    def save(new):
+        for net_id in new.values():
+            bind_network(net_id, org_id)
+        net_ids.update(new)
+        if record and new:
+            record(new)
+
+    if net_ids:
+        print(f'Found {len(net_ids)} network(s) already created!')
+        save(dict(net_ids))
+    actions = ActionBuffer()
+    for (site, location) in pending:
+        add_network(actions, org_id, location, custom_tags, isp_net)
+    if not actions:
+        return net_ids
+
+    if tuner:
+        print(f'POSTing auto-tuned action batch(es) to create networks, payloads journaled to {journal_path}')
+        (ok, data) = submit_tuned(api_key, org_id, actions, tuner, journal, on_batch=finished)
     else:
-        batch_id = data['id']
-        print(f'Action batch {batch_id} completed!')
+        print(f'POSTing synchronous action batch(es) to create networks, payloads journaled to {journal_path}')
+        (ok, data) = create_action_batch(api_key, org_id, True, True, actions, journal=journal, on_batch=finished)
     # input('Hit ENTER once manual POST is successful...')
+    if not (ok and data['status']['completed']):
+        print(data['status']['errors'] if isinstance(data, dict) and 'status' in data else data)
+    return net_ids
 
 
 # Helper function to claim devices
@@ -78,24 +158,26 @@ def add_devices(actions, net_id, serial):
         )
 
 
-# Create/claim devices using action batches
-def create_devices(api_key, org_id, actions):
-    with open('create_devices.json', 'w') as fp:
-        payload = {
-            'confirmed': True,
-            'synchronous': False,
-            'actions': actions
-        }
-        json.dump(payload, fp)
+# Create/claim devices using action batches, returning the batches that completed. Both ways of submitting
+# wait for every accepted batch, including those accepted before a rejected POST. record, if given,
+# is called with each completed batch as soon as it finishes.
+def create_devices(api_key, org_id, actions, journal=None, tuner=None, record=None):
+    def finished(batch):
+        if record and batch_state(batch) == 1:
+            record(batch)
 
-    print('POSTing one asynchronous action batch to claim devices, payload in create_devices.json')
-    (ok, data) = create_action_batch(api_key, org_id, True, False, actions)
-    if not ok:
-        print(data)
+    if tuner:
+        print(f'POSTing auto-tuned action batch(es) to claim devices, payloads journaled to {journal_path}')
+        (ok, data) = submit_tuned(api_key, org_id, actions, tuner, journal, on_batch=finished)
     else:
-        batch_id = data['id']
-        done = check_until_completed(api_key, org_id, batch_id)
+        print(f'POSTing asynchronous action batch(es) to claim devices, payloads journaled to {journal_path}')
+        (ok, data) = create_action_batch(api_key, org_id, True, False, actions, journal=journal, on_batch=finished)
+    if not ok:
+        print(data['status']['errors'])
+    for batch in data['batches']:
+        report_batch(batch)
     # input('Hit ENTER once manual POST is successful...')
+    return [batch for batch in data['batches'] if batch_state(batch) == 1]
 
 
 # Helper function to configure devices' attributes
@@ -107,7 +189,7 @@ def configure_device(actions, net_id, serial, name, address, user_name, custom_t
                 'operation': 'update',
                 'body': {
                     'name': name,
-                    'tags': ' '.join(random.sample(custom_tags + ['foo', 'bar', 'foobar', 'spam', 'ham', 'eggs'], 3)),
+                    'tags': pick_tags(custom_tags, serial),
                     'address': address,
                     'moveMapMarker': True,
                     'notes': f'installed by {user_name}'
@@ -180,12 +262,10 @@ def batch_vlans(actions, net_id, num):
 def batch_policies(actions, net_id):
     names = ['Employee', 'Executive', 'Guest', 'Sales', 'Support']
     for name in names:
-        body = policies[name]
-        body['name'] = name
         action = {
             'resource': f'/networks/{net_id}/groupPolicies',
             'operation': 'create',
-            'body': body
+            'body': compiled_policies[name]  # pre-serialized and shared, never modified
         }
         actions.append(action)
 
@@ -217,7 +297,7 @@ def batch_switchports(actions, switch, num, vlan, custom_tags):
                 body = {
                     'name': 'ready to connect!',
                     'type': 'access',
-                    'vlan': random.choice(range(vlan + 1, vlan + 4)),
+                    'vlan': random.Random(f'{switch}/{x}').choice(range(vlan + 1, vlan + 4)),
                 }
             elif x == 9:
                 body = {
@@ -227,7 +307,7 @@ def batch_switchports(actions, switch, num, vlan, custom_tags):
                 }
             else:
                 continue
-            body['tags'] = ' '.join(random.sample(custom_tags + ['foo', 'bar', 'foobar', 'spam', 'ham', 'eggs'], 3))
+            body['tags'] = pick_tags(custom_tags, f'{switch}/{x}')
             action = {
                 'resource': f'/devices/{switch}/switchPorts/{x}',
                 'operation': 'update',
@@ -236,32 +316,192 @@ def batch_switchports(actions, switch, num, vlan, custom_tags):
             actions.append(action)
 
 
-# Create/configure settings using action batches
-def create_settings(api_key, org_id, actions, counter):
-    with open(f'create_settings_{counter}.json', 'w') as fp:
-        payload = {
-            'confirmed': True,
-            'synchronous': True,
-            'actions': actions
-        }
-        json.dump(payload, fp)
-
-    print(f'POSTing one synchronous action batch to configure settings, payload in create_settings_{counter}.json')
-    (ok, data) = create_action_batch(api_key, org_id, True, True, actions)
-    if not ok:
-        if len(data) < 10 ** 3:
+# Build the actions that configure one site's settings. VLANs and group policies are created only once,
+# so leave them out with network_settings=False when they are already recorded as done.
+def build_settings(net_data, site, user_name, custom_tags, network_settings=True):
+    actions = ActionBuffer()
+    net_id = net_data['net_id']
+
+    for (device, description) in site.devices:
+        configure_device(actions, net_id, device, description, site.address, user_name, custom_tags)
+
+    # Configure management IP addresses (uplink interfaces) via action batch
+    batch_devices(actions, net_id, [(site.ms_serial, site.ms_ip), (site.mr_serial, site.mr_ip)], site.mgmt_vlan)
+
+    # Batch more settings
+    if network_settings:
+        batch_vlans(actions, net_id, site.site)  # create VLANs
+        batch_policies(actions, net_id)  # create group policies
+    batch_switchports(actions, site.ms_serial, site.site, site.mgmt_vlan, custom_tags)  # configure switch ports
+    return actions
+
+
+# Whether a site's settings submission applied every network-level action (VLANs, group policies),
+# even if some device-level ones were skipped
+def network_settings_applied(ok, data):
+    if ok:
+        return data['status']['completed']
+    return (isinstance(data, dict) and 'poisoned' in data and not data['rejected']
+            and all('/devices/' in entry['action']['resource'] for entry in data['poisoned']))
+
+
+# Print the outcome of a settings action batch
+def report_settings(ok, data):
+    if 'poisoned' in data:
+        # Isolated submission: the good actions went through, these didn't
+        if data['ids']:
+            print(f'Action batch {", ".join(str(id) for id in data["ids"])} completed!')
+        for entry in data['poisoned']:
+            action = entry['action']
+            print(f'Action {entry["index"]} ({action["operation"]} {action["resource"]}) skipped, it failed with errors {entry["errors"]}!')
+        if data['rejected']:
+            print(f'Remaining actions not submitted, action batch rejected with {data["rejected"]}!')
+    elif not ok:
+        if len(str(data)) < 10 ** 3:
             print(data)
+    elif not batch_ids(data):
+        print('Nothing to change!')
     else:
-        batch_id = data['id']
+        batch_id = ', '.join(str(id) for id in batch_ids(data))
         if data['status']['completed']:
             print(f'Action batch {batch_id} completed!')
         elif data['status']['failed']:
             print(f'Action batch {batch_id} failed with errors {data["status"]["errors"]}!')
 
-    # done = check_until_completed(api_key, org_id, batch_id)
+
+# Submit one site's stage as synchronous batch(es), holding one of the org's batch slots while it runs.
+# With isolate, actions that fail are reported and skipped while the rest are applied; the stage still
+# counts as failed, so it is retried on the next run.
+def submit_stage(api_key, org_id, actions, journal=None, isolate=False):
+    if not actions:
+        data = combine_batches([], True, True)
+        data['status']['completed'] = True
+        return (True, data)
+    with batch_slots(org_id):
+        if isolate:
+            (ok, data) = submit_isolating(api_key, org_id, actions, journal=journal)
+            if not ok:
+                data = '; '.join([f'{entry["action"]["operation"]} {entry["action"]["resource"]} skipped, it failed with errors {entry["errors"]}'
+                                  for entry in data['poisoned']] + ([f'rejected with {data["rejected"]}'] if data['rejected'] else []))
+            return (ok, data)
+        (ok, data) = create_action_batch(api_key, org_id, True, True, actions, journal=journal)
+    if ok and not data['status']['completed']:
+        return (False, data['status']['errors'])
+    return (ok, data)
+
+
+# Add one site's provisioning chain to a scheduler. The network comes first; VLANs and group policies
+# only need the network, while device and switch port settings also wait for the site's devices to be claimed.
+# net_id is the site's network if one is recorded already, recorded the stages store has for it, and claimed
+# those of its serials already claimed; none of these are redone, so an interrupted run resumes where it left off.
+def schedule_site(scheduler, api_key, org_id, site, store, isp_net, user_name, custom_tags, live=None, journal=None,
+                  net_id=None, recorded=frozenset(), claimed=frozenset()):
+    net = {'site': site.site, 'location': site.location, 'net_id': net_id}
+
+    def settings(device_level):
+        stage = 'device settings' if device_level else 'network settings'
+        if stage in recorded and live is None:
+            return (True, net['net_id'])
+        actions = [action for action in build_settings(net, site, user_name, custom_tags, not device_level)
+                   if ('/devices/' in action['resource']) == device_level]
+        if live is not None:
+            actions = reconcile(actions, fetch_current(api_key, org_id, actions, live))
+        (ok, data) = submit_stage(api_key, org_id, actions, journal, isolate=True)
+        if ok:
+            store.record_done(site.site, stage)
+        return (ok, data)
+
+    def network():
+        if net['net_id']:
+            return (True, net['net_id'])
+        actions = []
+        add_network(actions, org_id, site.location, custom_tags, isp_net)
+        (ok, data) = submit_stage(api_key, org_id, actions, journal)
+        if ok:
+            net['net_id'] = created_resources(data)[0]['id']
+            store.record_network(site.site, site.location, net['net_id'])
+            bind_network(net['net_id'], org_id)
+        return (ok, data)
+
+    def devices():
+        actions = []
+        for serial in site.serials:
+            if serial not in claimed:
+                add_devices(actions, net['net_id'], serial)
+        (ok, data) = submit_stage(api_key, org_id, actions, journal)
+        if ok:
+            store.record_claims((action['body']['serial'], net['net_id']) for action in actions)
+            store.record_done(site.site, 'devices')
+        return (ok, data)
+
+    def done():
+        store.record_done(site.site, 'settings')
+        return (True, net['net_id'])
+
+    name = f'Site {site.site}'
+    scheduler.add(f'{name} network', network)
+    scheduler.add(f'{name} devices', devices, [f'{name} network'])
+    scheduler.add(f'{name} network settings', lambda: settings(False), [f'{name} network'])
+    scheduler.add(f'{name} device settings', lambda: settings(True), [f'{name} devices'])
+    scheduler.add(f'{name} done', done, [f'{name} network settings', f'{name} device settings'])
+
+
+# Bind networks recorded in store, and the devices of sites, to org_id, so that calls on their
+# /networks/ and /devices/ paths count against the org's rate limit
+def bind_to_org(org_id, networks=(), sites=()):
+    for net in networks:
+        bind_network(net['net_id'], org_id)
+    for site in sites:
+        for serial in site.serials:
+            if serial:
+                bind_device(serial, org_id)
+
+
+# Print a finished provisioning task
+def print_progress(task):
+    if task.ok:
+        print(f'{task.name}: completed!')
+    elif len(str(task.data)) < 10 ** 3:
+        print(f'{task.name}: {task.data}')
+
+
+# Provision every site that isn't finished yet, each moving through its own chain independently of the others.
+# progress is called with each finished scheduler task.
+def provision_sites(api_key, org_id, sites, store, user_name, custom_tags, live=None, journal=None, progress=print_progress):
+    isp_net = get_isp_network(api_key, org_id)
+
+    # Read what is recorded once, rather than once per site
+    networks = store.networks()
+    bind_to_org(org_id, networks, sites)
+    net_ids = {net['site']: net['net_id'] for net in networks}
+    stages = {stage: store.done(stage) for stage in ('network settings', 'device settings')}
+    claimed = store.claimed()
+
+    scheduler = Scheduler(concurrency, progress)
+    for site in sites:
+        recorded = {stage for (stage, done) in stages.items() if site.site in done}
+        schedule_site(scheduler, api_key, org_id, site, store, isp_net, user_name, custom_tags, live, journal,
+                      net_ids.get(site.site), recorded, {serial for serial in site.serials if serial in claimed})
+    results = scheduler.run()
+    return [site for site in sites if results[f'Site {site.site} done'][0]]
 
 
 def main():
+    # With --reconcile, settings are diffed against live configuration and only changes are submitted
+    reconcile_mode = '--reconcile' in sys.argv[1:]
+
+    # With --cache, repeated reads (orgs, network listings, live settings) are served from a local cache
+    if '--cache' in sys.argv[1:]:
+        response_cache.enable()
+
+    # With --tune, batch sizes and synchronous/asynchronous submission adapt to how batches perform
+    tuner = BatchTuner() if '--tune' in sys.argv[1:] else None
+
+    # With --metrics, API call and batch timings are exported to metrics_path on exit
+    if '--metrics' in sys.argv[1:]:
+        metrics.enable()
+        atexit.register(metrics.write, metrics_path)
+
     # Get user's API key and check org access
     while True:
         api_key = input('Enter your Meraki dashboard API key: ')
@@ -292,10 +532,24 @@ def main():
     custom_tags = input('Enter in some optional custom tag(s): ')
     custom_tags = custom_tags.split()
 
+    # Parse the inventory once, for every stage to share
+    inventory = load_inventory('inventory.csv')
+    bind_to_org(org_id, sites=inventory)
+
+    # Every submitted batch and its response is appended here
+    journal = Journal(journal_path)
+    atexit.register(journal.close)
+
+    # Progress, recorded as work finishes so that a rerun resumes where it left off
+    store = StateStore(state_path)
+    atexit.register(store.close)
+
     # Create some stuff
     while True:
         print()
-        stop = input('Create which of the following?  1) Networks   2) Devices   3) Settings   4) Fun!   5 ) Bye!  ')
+        if tuner and tuner.batches:
+            print(tuner)
+        stop = input('Create which of the following?  1) Networks   2) Devices   3) Settings   4) Fun!   5 ) Bye!   6) All  ')
         stop = stop.lower()
         if 'network' in stop:
             stop = '1'
@@ -307,172 +561,147 @@ def main():
             stop = '4'
         elif 'fun' in stop:
             stop = '5'
+        elif 'all' in stop:
+            stop = '6'
 
-        try:
-            with open('networks_data.json') as fp:
-                networks_data = json.load(fp)
-        except (FileNotFoundError, JSONDecodeError):
-            networks_data = []
+        networks_data = store.networks()
+        bind_to_org(org_id, networks_data)
 
         # Creating networks
         if stop == '1':
-            if networks_data:
-                print('Networks already created, since networks_data.json exists!')
+            created = {net['site'] for net in networks_data}
+            todo = [site for site in inventory if site.site not in created]
+            if not todo:
+                print(f'Networks already created, per {state_path}!')
             else:
-                with open('inventory.csv', newline='\n', encoding='utf-8-sig') as csvfile:
-                    reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
-                    sites = []
-                    locations = []
-                    for row in reader:
-                        site = row['Site']
-                        location = row['Location']
-                        sites.append(site)
-                        locations.append(location)
-
-                    create_networks(api_key, org_id, sites, locations, custom_tags)
-
-                    networks_data = []
-                    (ok, data) = get_networks(api_key, org_id)
-                    if not ok:
-                        sys.exit(data)
-                    else:
-                        networks = data
-                    net_names = [network['name'] for network in networks]
-                    for (site, location) in zip(sites, locations):
-                        net_name = location.replace(',', ' -')
-                        if net_name in net_names:
-                            net_id = networks[net_names.index(net_name)]['id']
-                            networks_data.append({'net_id': net_id, 'location': location, 'site': site})
-                    with open('networks_data.json', 'w') as fp:
-                        json.dump(networks_data, fp)
-                    print('Log file networks_data.json updated!')
+                sites = [site.site for site in todo]
+                locations = [site.location for site in todo]
+
+                # Recorded batch by batch, so a crash part-way doesn't lose the networks already created
+                def record(net_ids):
+                    for (site, net_id) in net_ids.items():
+                        store.record_network(site, inventory[site].location, net_id)
+
+                create_networks(api_key, org_id, sites, locations, custom_tags, journal, tuner, record)
+                print(f'Progress recorded in {state_path}!')
 
         # Creating devices
         elif stop == '2':
             if not networks_data:
                 print('Networks need to be created first!')
             else:
-                with open('inventory.csv', newline='\n', encoding='utf-8-sig') as csvfile:
-                    counter = 0
-                    actions = []
-                    reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
-                    for row in reader:
-                        net_id = networks_data[counter]['net_id']
-                        mx_serial = row['MX device']
-                        ms_serial = row['MS device']
-                        mr_serial = row['MR device']
-                        mv_serial = row['MV device']
-                        mgmt_vlan = int(row['Mgmt. VLAN'])
-                        for serial in (mx_serial, ms_serial, mr_serial, mv_serial):
-                            add_devices(actions, net_id, serial)
-                        devices = [(mx_serial, 'SD-WAN UTM gateway'),
-                                   (ms_serial, 'Access switch'),
-                                   (mr_serial, 'Wireless AP'),
-                                   (mv_serial, 'Security camera')]
-                        networks_data[counter]['devices'] = devices
-                        networks_data[counter]['mgmt_vlan'] = mgmt_vlan
-                        counter += 1
-
-                    create_devices(api_key, org_id, actions)
-
-                    with open('networks_data.json', 'w') as fp:
-                        json.dump(networks_data, fp)
-                    print('Log file networks_data.json updated!')
+                claimed = store.claimed()
+                actions = ActionBuffer()
+                for net in networks_data:
+                    for serial in inventory[net['site']].serials:
+                        if serial not in claimed:
+                            add_devices(actions, net['net_id'], serial)
+
+                # Recorded batch by batch, so a crash part-way doesn't lose the claims already made
+                def record(batch):
+                    store.record_claims((action['body']['serial'], action['resource'].split('/')[2]) for action in batch['actions'])
+
+                if actions:
+                    create_devices(api_key, org_id, actions, journal, tuner, record)
+
+                # A site's devices are done once all of its serials are claimed
+                claimed = store.claimed()
+                for net in networks_data:
+                    if all(serial in claimed for serial in inventory[net['site']].serials if serial):
+                        store.record_done(net['site'], 'devices')
+                print(f'Progress recorded in {state_path}!')
 
         # Creating settings
         elif stop == '3':
+            claimed_sites = store.done('devices')
+            configured_sites = set() if reconcile_mode else store.done('settings')
+            todo = [net for net in networks_data if net['site'] in claimed_sites and net['site'] not in configured_sites]
             if not networks_data:
                 print('Networks need to be created first!')
-            elif 'devices' not in networks_data[0]:
+            elif not claimed_sites:
                 print('Devices need to be claimed first!')
+            elif not todo:
+                print(f'Settings already configured for every site with claimed devices, per {state_path}!')
             else:
-                with open('inventory.csv', newline='\n', encoding='utf-8-sig') as csvfile:
-                    reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
-                    counter = 0
-                    for row in reader:
-                        actions = []
-                        net_id = networks_data[counter]['net_id']
-                        mx_serial = row['MX device']
-                        ms_serial = row['MS device']
-                        mr_serial = row['MR device']
-                        mv_serial = row['MV device']
-                        mgmt_vlan = int(row['Mgmt. VLAN'])
-                        site = networks_data[counter]['site']
-                        location = networks_data[counter]['location']
-                        address = row['Address'] if 'Address' in row else location
-
-                        devices = [(mx_serial, 'SD-WAN UTM gateway'),
-                                   (ms_serial, 'Access switch'),
-                                   (mr_serial, 'Wireless AP'),
-                                   (mv_serial, 'Security camera')]
-                        for (device, description) in devices:
-                            configure_device(actions, net_id, device, description, address, user_name, custom_tags)
-
-                        # Configure management IP addresses (uplink interfaces) via action batch
-                        batch_devices(actions, net_id, [(ms_serial, row['MS IP']), (mr_serial, row['MR IP'])], mgmt_vlan)
-
-                        # Batch more settings
-                        settings_created = 'settings_created' in networks_data[counter]
-                        if not settings_created:
-                            batch_vlans(actions, net_id, site)  # create VLANs
-                            batch_policies(actions, net_id)  # create group policies
-                        batch_switchports(actions, ms_serial, site, mgmt_vlan, custom_tags)  # configure switch ports
-
-                        create_settings(api_key, org_id, actions, counter)
-                        networks_data[counter]['settings_created'] = True
-                        counter += 1
-                        time.sleep(10)
-
-                    with open('networks_data.json', 'w') as fp:
-                        json.dump(networks_data, fp)
+                live = LiveState()
+                # Reconciling skips VLANs and policies that already exist, so only a plain rerun needs the record
+                network_done = set() if reconcile_mode else store.done('network settings')
+
+                def build(net):
+                    actions = build_settings(net, inventory[net['site']], user_name, custom_tags, net['site'] not in network_done)
+                    if reconcile_mode:
+                        actions = reconcile(actions, fetch_current(api_key, org_id, actions, live))
+                    return actions
+
+                mode = 'auto-tuned' if tuner else 'synchronous'
+                print(f'POSTing {mode} action batches to configure settings, up to {MAX_CONCURRENT_BATCHES} at a time, payloads journaled to {journal_path}')
+                for (net, ok, data) in run_settings(api_key, org_id, todo, build, journal=journal, isolate=True, tuner=tuner):
+                    report_settings(ok, data)
+                    if network_settings_applied(ok, data):
+                        store.record_done(net['site'], 'network settings')
+                    if ok and data['status']['completed']:
+                        store.record_done(net['site'], 'settings')
 
         # Creating fun!
         elif stop == '4':
             if not networks_data:
                 print('Networks need to be created first!')
-            elif 'devices' not in networks_data[0]:
+            elif networks_data[0]['site'] not in store.done('devices'):
                 print('Devices need to be claimed first!')
             else:
-                with open('inventory.csv', newline='\n', encoding='utf-8-sig') as csvfile:
-                    reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
-                    row = next(reader)
-                    stage_net = networks_data[0]['net_id']
-                    stage_devices = networks_data[0]['devices']
-                    stage_cam = networks_data[0]['devices'][3][0]
-
-                    for (device, description) in stage_devices:
-                        (ok, data) = blink_device(api_key, stage_net, device, 120)
+                stage = inventory[networks_data[0]['site']]
+                stage_net = networks_data[0]['net_id']
+                stage_devices = stage.devices
+                stage_cam = stage.mv_serial
+
+                results = blink_devices(api_key, [(stage_net, device) for (device, description) in stage_devices], 120, org_id)
+                if any(ok for (ok, data) in results.values()):
+                    print(f'Devices should now be blinking!')
+
+                # Take a snapshot from on-stage camera
+                for x in range(3):
+                    if x == 0:
+                        message = '## 🎉🥂 Thank you for attending _Powerful, Programmable Cloud Networking with Meraki APIs_! 💪📝'
+                    elif x == 1:
+                        message = '## ✅😇 Check out the Developer Hub @ meraki.io! 🌎💚'
+                    elif x == 2:
+                        message = '## 🌟💫 Hope you enjoyed this demo, and thanks for watching! 🤜🤛'
+
+                    (ok, data) = take_snapshots(api_key, [(stage_net, stage_cam)], org_id=org_id)[stage_cam]
                     if ok:
-                        print(f'Devices should now be blinking!')
-
-                    # Take a snapshot from on-stage camera
-                    time.sleep(5)
-                    for x in range(3):
-                        if x == 0:
-                            message = '## 🎉🥂 Thank you for attending _Powerful, Programmable Cloud Networking with Meraki APIs_! 💪📝'
-                        elif x == 1:
-                            message = '## ✅😇 Check out the Developer Hub @ meraki.io! 🌎💚'
-                        elif x == 2:
-                            message = '## 🌟💫 Hope you enjoyed this demo, and thanks for watching! 🤜🤛'
-
-                        (ok, data) = take_snapshot(api_key, stage_net, stage_cam)
-                        if ok:
-                            print(message)
-                            photo = data['url']
-                            time.sleep(10)
-                            post_message(photo, message)
+                        print(message)
+                        photo = data['url']
+                        post_message(photo, message)
+                    else:
+                        print(data)
 
         # Bye!
         elif stop == '5':
-            for net in networks_data:
-                ok = delete_network(api_key, net['net_id'])
-                if ok:
+            if networks_data:
+                print(f'POSTing asynchronous action batch(es) to delete {len(networks_data)} network(s), payloads journaled to {journal_path}')
+                results = teardown_networks(api_key, org_id, [net['net_id'] for net in networks_data], journal=journal)
+                for net in networks_data:
+                    (ok, errors) = results[net['net_id']]
                     net_name = net["location"].replace(',', '-')
-                    print(f'Network {net_name} deleted!')
-            if os.path.exists('networks_data.json'):
-                os.remove('networks_data.json')
+                    if ok:
+                        print(f'Network {net_name} deleted!')
+                        store.forget_network(net['site'])
+                    else:
+                        print(f'Network {net_name} not deleted, errors {errors}!')
             sys.exit('Take care!')
 
+        # Creating networks, devices and settings, each site as soon as its own previous stage is done
+        elif stop == '6':
+            configured_sites = set() if reconcile_mode else store.done('settings')
+            todo = [site for site in inventory if site.site not in configured_sites]
+            if not todo:
+                print(f'Every site already provisioned, per {state_path}!')
+            else:
+                live = LiveState() if reconcile_mode else None
+                print(f'Provisioning {len(todo)} site(s), up to {MAX_CONCURRENT_BATCHES} action batches at a time, payloads journaled to {journal_path}')
+                finished = provision_sites(api_key, org_id, todo, store, user_name, custom_tags, live, journal)
+                print(f'{len(finished)} of {len(todo)} site(s) provisioned, progress recorded in {state_path}!')
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+
+# Local stand-in for the parts of the Dashboard API used by this project, for offline load testing.
+#
+#   python fake_dashboard.py --port 8080 --latency 0.05 --batch-delay 2 --rate 5
+#   MERAKI_BASE_URL=http://127.0.0.1:8080/api/v0 python demo.py
+#
+# Any non-empty API key is accepted. State lives in memory and is lost when the server stops.
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from action_batches import MAX_ACTIONS, MAX_CONCURRENT_BATCHES, MAX_SYNC_ACTIONS
+
+prefix = '/api/v0'
+
+
+# Non-blocking token bucket, used to answer 429 once an org goes over its budget
+class Budget:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    # Take a token, or return the seconds until one is available
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# In-memory organizations, networks, devices and action batches, with knobs for latency and failures
+class FakeDashboard:
+    def __init__(self, host='127.0.0.1', port=0, orgs=1, latency=0, jitter=0, batch_delay=1, rate=5, burst=10,
+                 fail_rate=0, fail_pattern=None, snapshot_delay=2):
+        self.latency = latency  # seconds added to every response
+        self.jitter = jitter  # random extra seconds, up to this much
+        self.batch_delay = batch_delay  # seconds for an asynchronous batch to finish
+        self.rate = rate  # requests per second per org before 429s; 0 disables throttling
+        self.burst = burst
+        self.fail_rate = fail_rate  # probability that any request fails with a 500
+        self.fail_pattern = re.compile(fail_pattern) if fail_pattern else None  # actions on matching resources fail
+        self.snapshot_delay = snapshot_delay  # seconds until a snapshot URL serves its image
+
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1000)
+        self.orgs = {str(n): {'id': str(n), 'name': f'Stand-in org {n}'} for n in range(1, orgs + 1)}
+        self.networks = {}
+        self.devices = {}
+        self.settings = {}  # resource path -> last body written to it
+        self.batches = {}
+        self.snapshots = {}
+        self.budgets = {}
+        self.requests = 0
+        self.throttled = 0
+
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        (host, port) = self.server.server_address[:2]
+        return f'http://{host}:{port}{prefix}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def next_id(self, kind):
+        return f'{kind}_{next(self.ids)}'
+
+    def handler(self):
+        dashboard = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.dispatch('GET')
+
+            def do_POST(self):
+                self.dispatch('POST')
+
+            def do_PUT(self):
+                self.dispatch('PUT')
+
+            def do_DELETE(self):
+                self.dispatch('DELETE')
+
+            def dispatch(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                url = urlparse(self.path)
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    return self.reply(400, {'errors': ['Invalid JSON']})
+                (status, data, headers) = dashboard.handle(method, url.path, parse_qs(url.query), body, self.headers)
+                self.reply(status, data, headers)
+
+            def reply(self, status, data, headers=None):
+                payload = data if isinstance(data, bytes) else json.dumps(data).encode()
+                headers = dict(headers or {})
+                # JSON reads carry an ETag, and are answered with an empty 304 when the client's copy is current
+                if self.command == 'GET' and status == 200 and not isinstance(data, bytes):
+                    headers['ETag'] = f'"{hashlib.sha1(payload).hexdigest()[:16]}"'
+                    if self.headers.get('If-None-Match') == headers['ETag']:
+                        (status, payload) = (304, b'')
+                self.send_response(status)
+                if payload:
+                    self.send_header('Content-Type', 'image/jpeg' if isinstance(data, bytes) else 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for (name, value) in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    # Route one request, returning (status, data, headers)
+    def handle(self, method, path, query, body, headers):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        match = re.fullmatch(r'/snapshots/(\w+)\.jpg', path)
+        if match:
+            return self.get_snapshot(match.group(1))
+
+        if not path.startswith(prefix):
+            return (404, {'errors': ['Not found']}, None)
+        path = path[len(prefix):].rstrip('/')
+        if not headers.get('X-Cisco-Meraki-API-Key'):
+            return (401, {'errors': ['Invalid API key']}, None)
+
+        with self.lock:
+            self.requests += 1
+            org_id = self.org_of(path)
+            if org_id and self.rate:
+                budget = self.budgets.setdefault(org_id, Budget(self.rate, self.burst))
+                wait = budget.take()
+                if wait:
+                    self.throttled += 1
+                    return (429, {'errors': ['API rate limit exceeded for organization']}, {'Retry-After': f'{wait:.2f}'})
+            if self.fail_rate and random.random() < self.fail_rate:
+                return (500, {'errors': ['Injected failure']}, None)
+
+            for (pattern, verb, route) in self.routes():
+                match = re.fullmatch(pattern, path)
+                if match and verb == method:
+                    return route(*match.groups(), query=query, body=body)
+            return (404, {'errors': ['Not found']}, None)
+
+    def routes(self):
+        return [
+            (r'/organizations', 'GET', self.list_orgs),
+            (r'/organizations/(\w+)/networks', 'GET', self.list_networks),
+            (r'/organizations/(\w+)/networks', 'POST', self.create_network),
+            (r'/networks/(\w+)', 'DELETE', self.delete_network),
+            (r'/networks/(\w+)/vlansEnabledState', 'PUT', self.vlans_enabled),
+            (r'/organizations/(\w+)/actionBatches', 'GET', self.list_batches),
+            (r'/organizations/(\w+)/actionBatches', 'POST', self.create_batch),
+            (r'/organizations/(\w+)/actionBatches/(\w+)', 'GET', self.get_batch),
+            (r'/organizations/(\w+)/actionBatches/(\w+)', 'PUT', self.update_batch),
+            (r'/organizations/(\w+)/actionBatches/(\w+)', 'DELETE', self.delete_batch),
+            (r'/organizations/(\w+)/devices', 'GET', self.list_devices),
+            (r'/networks/(\w+)/devices/([\w-]+)/managementInterfaceSettings', 'GET', self.get_setting),
+            (r'/networks/(\w+)/vlans', 'GET', self.list_vlans),
+            (r'/networks/(\w+)/groupPolicies', 'GET', self.list_policies),
+            (r'/devices/([\w-]+)/switchPorts', 'GET', self.list_switchports),
+            (r'/networks/(\w+)/devices/([\w-]+)/blinkLeds', 'POST', self.blink),
+            (r'/networks/(\w+)/cameras/([\w-]+)/snapshot', 'POST', self.snapshot),
+        ]
+
+    # The org a request counts against, for throttling
+    def org_of(self, path):
+        match = re.match(r'/organizations/(\w+)', path)
+        if match:
+            return match.group(1)
+        match = re.match(r'/networks/(\w+)', path)
+        if match and match.group(1) in self.networks:
+            return self.networks[match.group(1)]['organizationId']
+        return None
+
+    def list_orgs(self, query, body):
+        return (200, list(self.orgs.values()), None)
+
+    def list_networks(self, org_id, query, body):
+        if org_id not in self.orgs:
+            return (404, {'errors': ['Organization not found']}, None)
+        networks = [net for net in self.networks.values() if net['organizationId'] == org_id]
+        if 'perPage' not in query:
+            return (200, networks, None)
+        per_page = int(query['perPage'][0])
+        start = 0
+        if 'startingAfter' in query:
+            ids = [net['id'] for net in networks]
+            start = ids.index(query['startingAfter'][0]) + 1 if query['startingAfter'][0] in ids else len(ids)
+        page = networks[start:start + per_page]
+        headers = None
+        if start + per_page < len(networks):
+            link = f'{self.base_url}/organizations/{org_id}/networks?perPage={per_page}&startingAfter={page[-1]["id"]}'
+            headers = {'Link': f'<{link}>; rel=next'}
+        return (200, page, headers)
+
+    def create_network(self, org_id, query, body):
+        if org_id not in self.orgs:
+            return (404, {'errors': ['Organization not found']}, None)
+        if not body.get('name'):
+            return (400, {'errors': ['Name must be present']}, None)
+        net_id = self.next_id('N')
+        tags = body.get('tags') or ''
+        network = {
+            'id': net_id,
+            'organizationId': org_id,
+            'name': body['name'],
+            'type': body.get('type', 'wireless'),
+            'timeZone': body.get('timeZone', 'America/Los_Angeles'),
+            'tags': f' {tags} ' if tags else None,
+        }
+        self.networks[net_id] = network
+        self.settings[f'/networks/{net_id}/vlans/1'] = {'name': 'Default', 'subnet': '192.168.128.0/24', 'applianceIp': '192.168.128.1'}
+        return (201, network, None)
+
+    def delete_network(self, net_id, query, body):
+        if self.networks.pop(net_id, None) is None:
+            return (404, {'errors': ['Network not found']}, None)
+        return (204, b'', None)
+
+    def vlans_enabled(self, net_id, query, body):
+        if net_id not in self.networks:
+            return (404, {'errors': ['Network not found']}, None)
+        self.networks[net_id]['vlansEnabled'] = bool(body.get('enabled'))
+        return (200, {'enabled': self.networks[net_id]['vlansEnabled']}, None)
+
+    # Configuration written by action batches, read back
+
+    def children(self, collection, id_key):
+        return [dict(body, **{id_key: path.rsplit('/', 1)[1]}) for (path, body) in self.settings.items()
+                if path.rsplit('/', 1)[0] == collection]
+
+    def list_devices(self, org_id, query, body):
+        devices = []
+        for device in self.devices.values():
+            if self.networks.get(device['networkId'], {}).get('organizationId') == org_id:
+                devices.append(dict(self.settings.get(f'/networks/{device["networkId"]}/devices/{device["serial"]}', {}), **device))
+        return (200, devices, None)
+
+    def get_setting(self, net_id, serial, query, body):
+        return (200, self.settings.get(f'/networks/{net_id}/devices/{serial}/managementInterfaceSettings', {}), None)
+
+    def list_vlans(self, net_id, query, body):
+        return (200, self.children(f'/networks/{net_id}/vlans', 'id'), None)
+
+    def list_policies(self, net_id, query, body):
+        return (200, self.children(f'/networks/{net_id}/groupPolicies', 'groupPolicyId'), None)
+
+    def list_switchports(self, serial, query, body):
+        return (200, self.children(f'/devices/{serial}/switchPorts', 'number'), None)
+
+    def blink(self, net_id, serial, query, body):
+        return (202, {'duration': body.get('duration', 20), 'period': body.get('period', 160), 'duty': body.get('duty', 50)}, None)
+
+    def snapshot(self, net_id, serial, query, body):
+        token = self.next_id('S')
+        self.snapshots[token] = time.monotonic() + self.snapshot_delay
+        return (202, {'url': f'{self.base_url[:-len(prefix)]}/snapshots/{token}.jpg', 'expiry': 'in five minutes'}, None)
+
+    def get_snapshot(self, token):
+        with self.lock:
+            ready = self.snapshots.get(token)
+        if ready is None or time.monotonic() < ready:
+            return (404, {'errors': ['Snapshot not ready']}, None)
+        return (200, b'\xff\xd8\xff\xd9', None)
+
+    # Action batches
+
+    def running(self, org_id):
+        return [batch for batch in self.batches.values() if batch['organizationId'] == org_id and self.refresh(batch) and
+                batch['confirmed'] and not batch['status']['completed'] and not batch['status']['failed']]
+
+    def list_batches(self, org_id, query, body):
+        return (200, [self.view(batch) for batch in self.batches.values() if batch['organizationId'] == org_id], None)
+
+    def get_batch(self, org_id, batch_id, query, body):
+        batch = self.batches.get(batch_id)
+        if not batch or batch['organizationId'] != org_id:
+            return (404, {'errors': ['Action batch not found']}, None)
+        return (200, self.view(batch), None)
+
+    def create_batch(self, org_id, query, body):
+        if org_id not in self.orgs:
+            return (404, {'errors': ['Organization not found']}, None)
+        actions = body.get('actions') or []
+        synchronous = bool(body.get('synchronous'))
+        confirmed = bool(body.get('confirmed'))
+        limit = MAX_SYNC_ACTIONS if synchronous else MAX_ACTIONS
+        if len(actions) > limit:
+            return (400, {'errors': [f'Too many actions: {len(actions)}, at most {limit} are allowed']}, None)
+        if confirmed and not synchronous and len(self.running(org_id)) >= MAX_CONCURRENT_BATCHES:
+            return (429, {'errors': [f'At most {MAX_CONCURRENT_BATCHES} action batches may run at once']}, {'Retry-After': '1'})
+        batch = {
+            'id': self.next_id('B')[2:],
+            'organizationId': org_id,
+            'confirmed': confirmed,
+            'synchronous': synchronous,
+            'status': {'completed': False, 'failed': False, 'errors': [], 'createdResources': []},
+            'actions': actions,
+            'due': None,
+        }
+        self.batches[batch['id']] = batch
+        if confirmed:
+            self.confirm(batch)
+        return (201, self.view(batch), None)
+
+    def update_batch(self, org_id, batch_id, query, body):
+        batch = self.batches.get(batch_id)
+        if not batch or batch['organizationId'] != org_id:
+            return (404, {'errors': ['Action batch not found']}, None)
+        if 'synchronous' in body and not batch['confirmed']:
+            batch['synchronous'] = bool(body['synchronous'])
+        if body.get('confirmed') and not batch['confirmed']:
+            batch['confirmed'] = True
+            self.confirm(batch)
+        return (200, self.view(batch), None)
+
+    def delete_batch(self, org_id, batch_id, query, body):
+        batch = self.batches.get(batch_id)
+        if not batch or batch['organizationId'] != org_id:
+            return (404, {'errors': ['Action batch not found']}, None)
+        if batch['confirmed']:
+            return (400, {'errors': ['Only unconfirmed action batches can be deleted']}, None)
+        del self.batches[batch_id]
+        return (204, b'', None)
+
+    def confirm(self, batch):
+        if batch['synchronous']:
+            self.execute(batch)
+        else:
+            batch['due'] = time.monotonic() + self.batch_delay
+
+    # Run an asynchronous batch whose time has come; always true, for use in filters
+    def refresh(self, batch):
+        if batch['due'] is not None and time.monotonic() >= batch['due']:
+            batch['due'] = None
+            self.execute(batch)
+        return True
+
+    def view(self, batch):
+        self.refresh(batch)
+        return {key: value for (key, value) in batch.items() if key != 'due'}
+
+    # Apply every action of a batch, or none of them if any fails
+    def execute(self, batch):
+        errors = []
+        for (index, action) in enumerate(batch['actions']):
+            resource = action.get('resource', '')
+            operation = action.get('operation')
+            if self.fail_pattern and self.fail_pattern.search(resource):
+                errors.append(f'Action at index {index} failed: injected failure for {resource}')
+            elif operation not in ('create', 'update', 'destroy', 'claim'):
+                errors.append(f'Action at index {index} failed: unsupported operation {operation}')
+            elif operation == 'create' and re.fullmatch(r'/organizations/\w+/networks', resource) and not (action.get('body') or {}).get('name'):
+                errors.append(f'Action at index {index} failed: Name must be present')
+        if errors:
+            batch['status'].update(completed=False, failed=True, errors=errors)
+            return
+
+        created = []
+        for action in batch['actions']:
+            created.extend(self.apply(batch['organizationId'], action))
+        batch['status'].update(completed=True, failed=False, createdResources=created)
+
+    def apply(self, org_id, action):
+        resource = action['resource']
+        operation = action['operation']
+        body = action.get('body') or {}
+        match = re.fullmatch(r'/organizations/(\w+)/networks', resource)
+        if match and operation == 'create':
+            (status, network, headers) = self.create_network(match.group(1), {}, body)
+            return [{'id': network['id'], 'uri': f'{prefix}/networks/{network["id"]}'}]
+        match = re.fullmatch(r'/networks/(\w+)', resource)
+        if match and operation == 'destroy':
+            self.networks.pop(match.group(1), None)
+            return []
+        match = re.fullmatch(r'/networks/(\w+)/devices', resource)
+        if match and operation == 'claim':
+            self.devices[body.get('serial')] = {'serial': body.get('serial'), 'networkId': match.group(1)}
+            return []
+        if operation == 'create':
+            new_id = str(body.get('id') or self.next_id('R'))
+            self.settings[f'{resource}/{new_id}'] = dict(body)
+            return [{'id': new_id, 'uri': f'{prefix}{resource}/{new_id}'}]
+        if operation == 'update':
+            self.settings.setdefault(resource, {}).update(body)
+        elif operation == 'destroy':
+            self.settings.pop(resource, None)
+        return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Meraki Dashboard API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--orgs', type=int, default=1, help='number of organizations to serve')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra seconds per response, up to this much')
+    parser.add_argument('--batch-delay', type=float, default=1, help='seconds for an asynchronous batch to finish')
+    parser.add_argument('--rate', type=float, default=5, help='requests per second per org before 429s, 0 to disable')
+    parser.add_argument('--burst', type=float, default=10)
+    parser.add_argument('--fail-rate', type=float, default=0, help='probability of an injected 500 response')
+    parser.add_argument('--fail-pattern', help='regex; batch actions on matching resources fail')
+    parser.add_argument('--snapshot-delay', type=float, default=2, help='seconds until a snapshot URL is ready')
+    args = parser.parse_args()
+
+    dashboard = FakeDashboard(args.host, args.port, args.orgs, args.latency, args.jitter, args.batch_delay, args.rate,
+                              args.burst, args.fail_rate, args.fail_pattern, args.snapshot_delay)
+    print(f'Serving a stand-in Dashboard API at {dashboard.base_url}, use MERAKI_BASE_URL={dashboard.base_url}')
+    try:
+        dashboard.server.serve_forever()
+    except KeyboardInterrupt:
+        dashboard.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
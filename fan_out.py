@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Concurrent fan-out of per-device calls that action batches can't carry, like blinking LEDs and camera
+# snapshots. Calls run on a bounded thread pool and still go through each org's rate limiter in the client.
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+
+import requests
+
+import client
+from action_batches import backoff_delays
+from dashboard import blink_device, take_snapshot
+from rate_limit import bind_network
+
+# Snapshot URLs are on another host and must not carry the API key, so they're polled with their own session
+_session = requests.Session()
+
+
+# Call func(*args) for every tuple of args in jobs, at most max_workers at a time, yielding (args, result)
+# as each call finishes
+def fan_out(func, jobs, max_workers=None):
+    with ThreadPoolExecutor(max_workers=max_workers or client.pool_size) as executor:
+        futures = {executor.submit(func, *args): args for args in jobs}
+        for future in as_completed(futures):
+            yield (futures[future], future.result())
+
+
+# Wait until a URL serves content, e.g. a snapshot image that is still being generated, polling with backoff.
+# Returns whether it became ready within timeout seconds.
+def wait_until_ready(url, timeout=60, interval=0.5, max_interval=5):
+    deadline = time.monotonic() + timeout
+    delays = backoff_delays(interval, max_interval)
+    while True:
+        try:
+            with _session.get(url, stream=True, timeout=client.timeout) as response:
+                if response.ok:
+                    return True
+        except requests.RequestException:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(next(delays), remaining))
+
+
+# Blink the LEDs of every (net_id, serial) in devices, returning {serial: (ok, data)}.
+# With org_id, the networks are bound to it so that the calls share the org's rate limit.
+def blink_devices(api_key, devices, duration=20, org_id=None, max_workers=None):
+    jobs = []
+    for (net_id, serial) in devices:
+        if org_id:
+            bind_network(net_id, org_id)
+        jobs.append((api_key, net_id, serial, duration))
+    return {args[2]: result for (args, result) in fan_out(blink_device, jobs, max_workers)}
+
+
+def _snapshot(api_key, net_id, serial, timestamp, timeout):
+    (ok, data) = take_snapshot(api_key, net_id, serial, timestamp)
+    if ok and not wait_until_ready(data['url'], timeout):
+        return (False, f'Snapshot {data["url"]} not ready after {timeout} seconds')
+    return (ok, data)
+
+
+# Take a snapshot from every (net_id, serial) camera in cameras, returning {serial: (ok, data)} once each
+# snapshot's URL actually serves the image, or with ok False if it doesn't within timeout seconds
+def take_snapshots(api_key, cameras, timestamp=None, timeout=60, org_id=None, max_workers=None):
+    jobs = []
+    for (net_id, serial) in cameras:
+        if org_id:
+            bind_network(net_id, org_id)
+        jobs.append((api_key, net_id, serial, timestamp, timeout))
+    return {args[2]: result for (args, result) in fan_out(_snapshot, jobs, max_workers)}
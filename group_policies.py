@@ -1,3 +1,5 @@
+from payloads import RawJSON
+
 policies = {
     'Employee': {
         'bandwidth': {
@@ -299,4 +301,7 @@ policies = {
             ]
         }
     }
-}
\ No newline at end of file
+}
+
+# Each policy body with its name, serialized once for splicing into action batch payloads
+compiled = {name: RawJSON.from_value(dict(body, name=name)) for (name, body) in policies.items()}
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# Append-only NDJSON journal of submitted action batches: one line per POST with its payload,
+# the server's response and timings. Paths ending in .gz are gzip-compressed.
+#
+# Every record is flushed to the file as it is written (a zlib sync flush when compressed), so a crash
+# loses at most the record being written. A run that dies leaves its gzip member without a trailer;
+# read_journal reads such a member up to where it stops and carries on with the next run's member.
+
+import gzip
+import json
+import os
+import threading
+import zlib
+
+from payloads import RawJSON, encode
+
+
+class Journal:
+    def __init__(self, path, compress=None, buffer_size=1 << 16):
+        self.path = path
+        compress = path.endswith('.gz') if compress is None else compress
+        if not compress:
+            _end_line(path)
+        raw = open(path, 'ab', buffering=buffer_size)
+        self.fp = gzip.GzipFile(fileobj=raw, mode='ab') if compress else raw
+        self.raw = raw
+        self.lock = threading.Lock()
+
+    # Append one submission. payload is the exact request body bytes, reused rather than re-encoded.
+    def record(self, org_id, payload, ok, response, started, elapsed, kind='action_batch'):
+        line = encode({
+            'kind': kind,
+            'org_id': org_id,
+            'started': round(started, 6),
+            'elapsed': round(elapsed, 6),
+            'ok': ok,
+            'request': RawJSON(payload),
+            'response': response,
+        }) + b'\n'
+        with self.lock:
+            self.fp.write(line)
+            self._flush()
+
+    # Push everything written so far to the file, leaving a compressed stream readable up to this point
+    def _flush(self):
+        if self.fp is not self.raw:
+            self.fp.flush(zlib.Z_SYNC_FLUSH)
+        self.raw.flush()
+
+    def flush(self):
+        with self.lock:
+            self.fp.flush()
+            if self.fp is not self.raw:
+                self.raw.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.raw.closed:
+                self.fp.close()
+                self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Terminate a record left half-written by a crash, so that appended records start on a line of their own
+def _end_line(path):
+    try:
+        with open(path, 'rb+') as fp:
+            if fp.seek(0, os.SEEK_END) == 0:
+                return
+            fp.seek(-1, os.SEEK_END)
+            if fp.read(1) != b'\n':
+                fp.write(b'\n')
+    except FileNotFoundError:
+        pass
+
+
+_gzip_magic = b'\x1f\x8b\x08'
+
+
+# The data from the first gzip header at or after start from which it decompresses, or b'' if there is none
+def _next_member(data, start=0):
+    while True:
+        start = data.find(_gzip_magic, start)
+        if start < 0:
+            return b''
+        try:
+            zlib.decompressobj(31).decompress(data[start:])
+            return data[start:]
+        except zlib.error:
+            start += 1
+
+
+# Decompress consecutive gzip members. Unlike gzip.open, a member cut off by a crash is read as far as it
+# goes, and reading resumes at the member appended after it. Yields (data, complete): complete is False
+# where a member broke off, so that a line in progress there is known to be truncated.
+def _gunzip(raw, chunk_size=1 << 16):
+    decompressor = zlib.decompressobj(31)
+    fresh = True  # nothing fed to decompressor yet
+    previous = b''  # the data last fed to it
+    data = b''
+    while True:
+        chunk = raw.read(chunk_size)
+        if not chunk and not data:
+            return
+        data += chunk
+        state = decompressor.copy()
+        try:
+            out = decompressor.decompress(data)
+        except zlib.error:
+            # Find how far the data decompresses: there the cut-off member stops and the next one should start
+            (low, high) = (0, len(data))
+            while low < high:
+                middle = (low + high + 1) // 2
+                try:
+                    state.copy().decompress(data[:middle])
+                    low = middle
+                except zlib.error:
+                    high = middle - 1
+            yield (state.decompress(data[:low]), False)
+            # The next member starts where the cut-off one stops or, if the cut fell inside a deflate block,
+            # somewhere before the error showed up
+            data = _next_member(data, 1) if fresh else _next_member(previous + data)
+            decompressor = zlib.decompressobj(31)
+            fresh = True
+            continue
+        fresh = False
+        previous = data
+        yield (out, True)
+        data = decompressor.unused_data
+        if decompressor.eof:
+            decompressor = zlib.decompressobj(31)
+            fresh = True
+        elif not chunk:
+            return  # the last member stops short: its run is still going, or crashed
+
+
+# Stream the entries of a journal back, one dict at a time, whether or not it is compressed.
+# A record cut short by a crash is skipped.
+def read_journal(path):
+    with open(path, 'rb') as raw:
+        compressed = raw.read(2) == _gzip_magic[:2]
+        raw.seek(0)
+        pieces = _gunzip(raw) if compressed else ((chunk, True) for chunk in iter(lambda: raw.read(1 << 16), b''))
+        partial = b''
+        for (data, complete) in pieces:
+            lines = (partial + data).split(b'\n')
+            partial = lines.pop() if complete else b''
+            for line in lines:
+                if line.strip():
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # cut short by a crash
+                    yield entry
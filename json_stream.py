@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Incremental decoding of JSON array responses, so that the caller sees the first item as soon as it
+# arrives and only one chunk of the body is held at a time, rather than the whole list.
+
+import codecs
+import json
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+
+# Only the given fields of an item, or the item itself if fields is None
+def project(item, fields=None):
+    if fields is None or not isinstance(item, dict):
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+
+# Yield the items of a JSON array from a streamed response (one requested with stream=True),
+# optionally projected to the given fields. The response is closed when the generator finishes or is closed.
+def iter_array(response, fields=None, chunk_size=1 << 16):
+    chunks = response.iter_content(chunk_size)
+    text = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+    buffer = ''
+    position = 0
+    done = False
+    started = False
+    after_value = False  # an item was just read, so ',' or ']' comes next
+    after_comma = False  # a ',' was just read, so an item comes next
+
+    try:
+        while True:
+            while position < len(buffer) and buffer[position] in _whitespace:
+                position += 1
+            if position < len(buffer):
+                char = buffer[position]
+                if not started:
+                    if char != '[':
+                        raise ValueError(f'Expected a JSON array, got {buffer[position:position + 20]!r}')
+                    started = True
+                    position += 1
+                    continue
+                if char == ']' and not after_comma:
+                    return
+                if after_value:
+                    if char != ',':
+                        raise ValueError(f"Expected ',' or ']' in JSON array, got {buffer[position:position + 20]!r}")
+                    (after_value, after_comma) = (False, True)
+                    position += 1
+                    continue
+                if char in ',]':
+                    raise ValueError(f'Expected a value in JSON array, got {buffer[position:position + 20]!r}')
+                try:
+                    (item, end) = _decoder.raw_decode(buffer, position)
+                except ValueError:
+                    end = None
+                # A number may be cut short anywhere, even right after its '.' or 'e' (so '[1.' decodes as 1),
+                # so unless it is followed by a separator, wait for more. Strings and containers end themselves.
+                if end is not None and (done or isinstance(item, (dict, list, str))
+                                        or (end < len(buffer) and buffer[end] in _whitespace + ',]')):
+                    yield project(item, fields)
+                    position = end
+                    (after_value, after_comma) = (True, False)
+                    continue
+                if done:
+                    raise ValueError(f'Truncated JSON array at {buffer[position:position + 20]!r}')
+            elif done:
+                raise ValueError('Truncated JSON array')
+
+            # Drop what has been consumed, then read another chunk
+            buffer = buffer[position:]
+            position = 0
+            chunk = next(chunks, None)
+            if chunk is None:
+                buffer += text.decode(b'', final=True)
+                done = True
+            else:
+                buffer += text.decode(chunk)
+    finally:
+        response.close()
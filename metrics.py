@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# Per-endpoint instrumentation of API calls and action batches, off by default. When off, the only cost
+# to callers is checking metrics.enabled. Export with snapshot() (JSON-friendly) or prometheus() (text format).
+
+import json
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+enabled = False
+
+# Histogram bucket upper bounds: request and batch latencies in seconds, and actions per batch
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+duration_buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+action_buckets = (1, 5, 10, 20, 50, 100)
+
+# Path segments followed by an ID, which is replaced by {id} so that calls group by endpoint
+_collections = {'organizations', 'networks', 'devices', 'actionBatches', 'vlans', 'groupPolicies', 'switchPorts',
+                'snapshots'}
+_version_prefix = re.compile(r'^/api/v\d+')
+
+_lock = threading.Lock()
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one counts values above every bound
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    # Cumulative counts per upper bound, as Prometheus expects, ending with +Inf
+    def cumulative(self):
+        total = 0
+        buckets = []
+        for (bound, count) in zip(self.bounds + ('+Inf',), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': round(self.sum, 6),
+                'buckets': {str(bound): count for (bound, count) in self.cumulative()}}
+
+
+def _fresh():
+    return {
+        'requests': {},  # (method, endpoint, status) -> count
+        'latency': {},  # (method, endpoint) -> Histogram of seconds per attempt
+        'retries': {},  # (method, endpoint) -> count of retried attempts
+        'throttled': {},  # (method, endpoint) -> count of 429 responses
+        'bytes_sent': {},  # (method, endpoint) -> request body bytes
+        'bytes_received': {},  # (method, endpoint) -> response body bytes
+        'batch_actions': {},  # (mode,) -> Histogram of actions per submitted batch
+        'batch_duration': {},  # (mode, outcome) -> Histogram of seconds from submission to completion
+    }
+
+
+_metrics = _fresh()
+_submitted = {}  # batch ID -> (submission time, mode), until the batch is seen to finish
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    global _metrics
+    with _lock:
+        _metrics = _fresh()
+        _submitted.clear()
+
+
+# Group a request path or URL by endpoint, e.g. /organizations/123/networks -> /organizations/{id}/networks
+def endpoint(url):
+    path = _version_prefix.sub('', urlsplit(url).path)
+    segments = path.split('/')
+    for index in range(1, len(segments)):
+        if segments[index - 1] in _collections and segments[index]:
+            segments[index] = '{id}'
+    return '/'.join(segments)
+
+
+def _add(name, key, amount=1):
+    counters = _metrics[name]
+    counters[key] = counters.get(key, 0) + amount
+
+
+def _observe(name, key, bounds, value):
+    histograms = _metrics[name]
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = Histogram(bounds)
+    histogram.observe(value)
+
+
+# Record one attempt of an API call. retried is True if the call will be sent again after this response.
+def record_request(method, url, response, seconds, retried=False, stream=False):
+    key = (method, endpoint(url))
+    body = response.request.body if response.request is not None else None
+    sent = len(body) if body else 0
+    if stream:
+        received = int(response.headers.get('Content-Length', 0))  # don't consume a streamed body here
+    else:
+        received = len(response.content or b'')
+    with _lock:
+        _add('requests', key + (str(response.status_code),))
+        _observe('latency', key, latency_buckets, seconds)
+        _add('bytes_sent', key, sent)
+        _add('bytes_received', key, received)
+        if response.status_code == 429:
+            _add('throttled', key)
+        if retried:
+            _add('retries', key)
+
+
+def _mode(synchronous):
+    return 'synchronous' if synchronous else 'asynchronous'
+
+
+# Record a batch POSTed at submitted (a time.time() value). Synchronous batches are finished when
+# the POST returns; asynchronous ones are timed until batch_finished() is called for them.
+def batch_submitted(batch, actions, synchronous, submitted):
+    mode = _mode(synchronous)
+    with _lock:
+        _observe('batch_actions', (mode,), action_buckets, actions)
+        if batch['status']['completed'] or batch['status']['failed']:
+            outcome = 'completed' if batch['status']['completed'] else 'failed'
+            _observe('batch_duration', (mode, outcome), duration_buckets, time.time() - submitted)
+        else:
+            _submitted[str(batch['id'])] = (submitted, mode)
+
+
+def batch_finished(batch):
+    with _lock:
+        submission = _submitted.pop(str(batch['id']), None)
+        if submission:
+            (submitted, mode) = submission
+            outcome = 'completed' if batch['status']['completed'] else 'failed'
+            _observe('batch_duration', (mode, outcome), duration_buckets, time.time() - submitted)
+
+
+_labels = {
+    'requests': ('method', 'endpoint', 'status'),
+    'latency': ('method', 'endpoint'),
+    'retries': ('method', 'endpoint'),
+    'throttled': ('method', 'endpoint'),
+    'bytes_sent': ('method', 'endpoint'),
+    'bytes_received': ('method', 'endpoint'),
+    'batch_actions': ('mode',),
+    'batch_duration': ('mode', 'outcome'),
+}
+
+
+# All metrics as plain dicts and lists, ready for json.dump
+def snapshot():
+    with _lock:
+        data = {}
+        for (name, values) in _metrics.items():
+            data[name] = [
+                dict(zip(_labels[name], key), **(value.as_dict() if isinstance(value, Histogram) else {'value': value}))
+                for (key, value) in sorted(values.items())
+            ]
+        return data
+
+
+def _prom_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    return '{' + ','.join(f'{name}="{value}"' for (name, value) in pairs) + '}'
+
+
+_prom = {
+    'requests': ('meraki_api_requests_total', 'counter', 'API call attempts by response status'),
+    'latency': ('meraki_api_request_seconds', 'histogram', 'Latency of each API call attempt'),
+    'retries': ('meraki_api_retries_total', 'counter', 'API call attempts that were retried'),
+    'throttled': ('meraki_api_throttled_total', 'counter', 'API call attempts rejected with 429'),
+    'bytes_sent': ('meraki_api_sent_bytes_total', 'counter', 'Request body bytes sent'),
+    'bytes_received': ('meraki_api_received_bytes_total', 'counter', 'Response body bytes received'),
+    'batch_actions': ('meraki_action_batch_actions', 'histogram', 'Actions per submitted action batch'),
+    'batch_duration': ('meraki_action_batch_seconds', 'histogram', 'Action batch time from submission to completion'),
+}
+
+
+# All metrics in the Prometheus text exposition format
+def prometheus():
+    lines = []
+    with _lock:
+        for (name, values) in _metrics.items():
+            (metric, kind, description) = _prom[name]
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for (key, value) in sorted(values.items()):
+                if isinstance(value, Histogram):
+                    for (bound, count) in value.cumulative():
+                        lines.append(f'{metric}_bucket{_prom_labels(_labels[name], key, [("le", bound)])} {count}')
+                    lines.append(f'{metric}_sum{_prom_labels(_labels[name], key)} {value.sum:.6f}')
+                    lines.append(f'{metric}_count{_prom_labels(_labels[name], key)} {value.count}')
+                else:
+                    lines.append(f'{metric}{_prom_labels(_labels[name], key)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Write the current metrics to path, as Prometheus text if it ends in .prom and JSON otherwise
+def write(path):
+    with open(path, 'w') as fp:
+        if path.endswith('.prom'):
+            fp.write(prometheus())
+        else:
+            json.dump(snapshot(), fp, indent=2)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# Provision many organizations at once, each from its own inventory, spread over a pool of processes.
+#
+#   MERAKI_DASHBOARD_API_KEY=... python multi_org.py --orgs 123 456 789 --inventory 'inventory-{org}.csv'
+#
+# A device serial can only be claimed into one org, so every org needs an inventory of its own devices.
+# The work is I/O-bound and rate limited per org, so by default every org gets its own worker process.
+# Each worker process has its own connection pool and per-org rate limiters, and keeps its own state and
+# journal per org (provisioning-<org>.db, action_batches-<org>.ndjson.gz), so reruns resume per org.
+# Progress from every worker is reported by the parent.
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import os
+import threading
+
+import client
+import rate_limit
+
+
+# Client settings a worker needs to match the parent, since configure() calls don't reach other processes
+def worker_settings():
+    return {'url': client.base_url, 'pool_size': client.pool_size, 'timeout': client.timeout,
+            'max_retries': client.max_retries, 'rate': rate_limit.rate, 'burst': rate_limit.burst}
+
+
+# Provision one org, in a worker process. Returns (org_id, ok, provisioned site IDs or an error).
+def provision_org(api_key, org_id, inventory_path, user_name, custom_tags, settings, progress=None, state_dir='.'):
+    import demo
+    from journal import Journal
+    from sites import load_inventory
+    from state import StateStore
+
+    client.close_clients()  # don't reuse sockets inherited from the parent
+    client.configure(settings['pool_size'], settings['timeout'], settings['max_retries'], settings['url'])
+    rate_limit.rate = settings['rate']
+    rate_limit.burst = settings['burst']
+
+    try:
+        inventory = load_inventory(inventory_path)
+    except OSError as error:
+        return (org_id, False, str(error))
+    store = StateStore(os.path.join(state_dir, f'provisioning-{org_id}.db'))
+    journal = Journal(os.path.join(state_dir, f'action_batches-{org_id}.ndjson.gz'))
+    done = store.done('settings')
+    todo = [site for site in inventory if site.site not in done]
+    if progress is not None:
+        progress.put((org_id, 'start', len(todo) * 5))
+
+    def report(task):
+        if progress is not None:
+            progress.put((org_id, task.name, task.ok if task.ok else str(task.data)[:200]))
+
+    try:
+        finished = demo.provision_sites(api_key, org_id, todo, store, user_name, custom_tags, journal=journal, progress=report)
+        return (org_id, len(finished) == len(todo), [site.site for site in finished])
+    except (Exception, SystemExit) as error:  # get_isp_network exits on failure
+        return (org_id, False, str(error))
+    finally:
+        journal.close()
+        store.close()
+        client.close_clients()
+
+
+# Print the progress messages of every worker as they arrive, with a running count per org
+def print_progress(progress):
+    totals = {}
+    counts = {}
+    while True:
+        message = progress.get()
+        if message is None:
+            return
+        (org_id, name, outcome) = message
+        if name == 'start':
+            totals[org_id] = outcome
+            counts[org_id] = 0
+            continue
+        counts[org_id] = counts.get(org_id, 0) + 1
+        status = 'completed!' if outcome is True else outcome
+        print(f'[org {org_id} {counts[org_id]}/{totals.get(org_id, "?")}] {name}: {status}')
+
+
+# The inventory file of each org, from a path template such as 'inventory-{org}.csv'
+def inventory_paths(template, org_ids):
+    return {org_id: template.format(org=org_id) for org_id in org_ids}
+
+
+# Serials listed in more than one org's inventory, as {serial: [org IDs]}; inventories that can't be read are skipped
+def shared_serials(paths):
+    from sites import load_inventory
+
+    orgs = {}
+    for (org_id, path) in paths.items():
+        try:
+            inventory = load_inventory(path)
+        except OSError:
+            continue
+        for site in inventory:
+            for serial in site.serials:
+                if serial:
+                    orgs.setdefault(serial, []).append(org_id)
+    return {serial: ids for (serial, ids) in orgs.items() if len(ids) > 1}
+
+
+# Provision every org in org_ids over up to processes worker processes (one per org by default),
+# each from the inventory at inventory_path formatted with its org ID. Returns {org_id: (ok, sites or error)}.
+def run_orgs(api_key, org_ids, inventory_path, user_name='', custom_tags=(), processes=None, state_dir='.'):
+    paths = inventory_paths(inventory_path, org_ids)
+    processes = processes or len(org_ids)
+    results = {}
+    with multiprocessing.Manager() as manager:
+        progress = manager.Queue()
+        printer = threading.Thread(target=print_progress, args=(progress,), daemon=True)
+        printer.start()
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(provision_org, api_key, org_id, paths[org_id], user_name, list(custom_tags),
+                                       worker_settings(), progress, state_dir) for org_id in org_ids]
+            for future in as_completed(futures):
+                (org_id, ok, data) = future.result()
+                results[org_id] = (ok, data)
+        progress.put(None)
+        printer.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Provision the inventory into several organizations in parallel')
+    parser.add_argument('--api-key', default=os.environ.get('MERAKI_DASHBOARD_API_KEY'), help='defaults to $MERAKI_DASHBOARD_API_KEY')
+    parser.add_argument('--orgs', nargs='+', help='organization IDs, defaults to every org the API key can access')
+    parser.add_argument('--inventory', default='inventory-{org}.csv',
+                        help='inventory file per org, with {org} replaced by the org ID')
+    parser.add_argument('--name', default='', help='name(s) noted on configured devices')
+    parser.add_argument('--tags', nargs='*', default=[], help='optional custom tags')
+    parser.add_argument('--processes', type=int, help='worker processes, defaults to one per org')
+    args = parser.parse_args()
+    if not args.api_key:
+        parser.error('an API key is required, with --api-key or $MERAKI_DASHBOARD_API_KEY')
+
+    org_ids = args.orgs
+    if not org_ids:
+        from dashboard import get_user_orgs
+        (ok, orgs) = get_user_orgs(args.api_key)
+        if not ok:
+            parser.exit(1, f'{orgs}\n')
+        org_ids = [str(org['id']) for org in orgs]
+    client.close_clients()
+
+    # A serial can only be claimed into one org, so refuse inventories that share devices
+    if len(org_ids) > 1 and '{org}' not in args.inventory:
+        parser.error('--inventory needs an {org} placeholder, so that each org gets its own devices')
+    shared = shared_serials(inventory_paths(args.inventory, org_ids))
+    if shared:
+        parser.error('serials listed for more than one org: ' + ', '.join(f'{serial} ({", ".join(ids)})' for (serial, ids) in shared.items()))
+
+    results = run_orgs(args.api_key, org_ids, args.inventory, args.name, args.tags, args.processes)
+    print()
+    for org_id in org_ids:
+        (ok, data) = results[org_id]
+        if ok:
+            print(f'Org {org_id}: {len(data)} site(s) provisioned!')
+        else:
+            print(f'Org {org_id}: failed, {data}')
+
+
+if __name__ == '__main__':
+    main()
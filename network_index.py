@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+
+# Tags of a network as a list, whether the API returned a space-separated string or a list
+def network_tags(network):
+    tags = network.get('tags') or []
+    return tags.split() if isinstance(tags, str) else list(tags)
+
+
+# Constant-time lookups of networks by ID, name and tag.
+# Names aren't unique within an org, so name and tag lookups return lists.
+class NetworkIndex:
+    def __init__(self, networks=()):
+        self.by_id = {}
+        self.by_name = {}
+        self.by_tag = {}
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        self.by_id[network['id']] = network
+        self.by_name.setdefault(network['name'], []).append(network)
+        for tag in network_tags(network):
+            self.by_tag.setdefault(tag, []).append(network)
+
+    def remove(self, net_id):
+        network = self.by_id.pop(net_id, None)
+        if network:
+            self.by_name[network['name']].remove(network)
+            for tag in network_tags(network):
+                self.by_tag[tag].remove(network)
+        return network
+
+    def get(self, net_id, default=None):
+        return self.by_id.get(net_id, default)
+
+    def named(self, name):
+        return list(self.by_name.get(name, ()))
+
+    # The only network with this name, or None; raises ValueError if the name is ambiguous
+    def unique(self, name):
+        matches = self.by_name.get(name, ())
+        if len(matches) > 1:
+            raise ValueError(f'{len(matches)} networks are named "{name}"')
+        return matches[0] if matches else None
+
+    def tagged(self, tag):
+        return list(self.by_tag.get(tag, ()))
+
+    def __contains__(self, net_id):
+        return net_id in self.by_id
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def __len__(self):
+        return len(self.by_id)
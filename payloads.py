@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+
+
+# A value that has already been serialized to JSON. It is spliced verbatim into payloads built with encode(),
+# so that shared bodies (e.g. group policy templates) are encoded once instead of once per site.
+class RawJSON:
+    __slots__ = ('encoded',)
+
+    def __init__(self, encoded):
+        object.__setattr__(self, 'encoded', bytes(encoded))
+
+    @classmethod
+    def from_value(cls, value):
+        return cls(encode(value))
+
+    # Decoded copy of the value, for inspection or comparison
+    @property
+    def value(self):
+        return json.loads(self.encoded)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('RawJSON is immutable')
+
+    # Rebuilt from the encoded bytes when pickled, e.g. to send actions to a worker process
+    def __reduce__(self):
+        return (RawJSON, (self.encoded,))
+
+    # Immutable, so copies can share the same instance
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, RawJSON) and self.encoded == other.encoded
+
+    def __hash__(self):
+        return hash(self.encoded)
+
+    def __repr__(self):
+        return f'RawJSON({self.encoded[:60]!r}{"..." if len(self.encoded) > 60 else ""})'
+
+
+# RawJSON values are first encoded as placeholder strings carrying a random per-call token, then swapped
+# for their bytes. A string in the payload that happens to look like a placeholder won't have the token.
+_placeholder = re.compile(rb'"\\u0000raw:([0-9a-f]{16}):(\d+)\\u0000"')
+
+
+# Compact JSON bytes for a payload, splicing in any RawJSON values without re-encoding them
+def encode(value):
+    raws = []
+    token = os.urandom(8).hex()
+
+    def default(obj):
+        if isinstance(obj, RawJSON):
+            raws.append(obj.encoded)
+            return f'\x00raw:{token}:{len(raws) - 1}\x00'
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+    def splice(match):
+        return raws[int(match.group(2))] if match.group(1).decode() == token else match.group(0)
+
+    encoded = json.dumps(value, default=default, separators=(',', ':')).encode()
+    if not raws:
+        return encoded
+    return _placeholder.sub(splice, encoded)
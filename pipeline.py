@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+
+from action_batches import (batch_slots, chunk_actions, combine_batches, create_action_batch, run_async_batches,
+                            submit_isolating, submit_tuned)
+
+# Default number of sites being built and submitted at the same time
+concurrency = 10
+
+
+# Build and submit one action batch per job (e.g. per site) concurrently, yielding (job, ok, data) as each finishes.
+# build(job) returns that job's list of actions; it runs on the worker threads, so building one site's payload
+# overlaps the network waits of others. At most MAX_CONCURRENT_BATCHES batches run in the org at once,
+# and asynchronous batches hold their slot until they complete or fail. size caps the actions per batch,
+# and submissions are recorded in journal if one is given. With isolate, failing actions are weeded out
+# with submit_isolating and the rest still applied, instead of the job's whole batch failing.
+# With a batch_tuner.BatchTuner, it picks the batch size and mode instead of synchronous and size.
+# on_start, if given, is called with a job on its worker thread once the job holds a batch slot,
+# before its first batch is posted, so that time spent waiting for a slot can be told apart.
+def run_settings(api_key, org_id, jobs, build, max_workers=None, synchronous=True, size=None, journal=None, isolate=False,
+                 tuner=None, on_start=None):
+    slots = batch_slots(org_id)
+
+    def work(job):
+        actions = build(job)
+        if not actions:
+            # Nothing to submit, e.g. everything already matches live configuration
+            data = combine_batches([], True, synchronous)
+            data['status']['completed'] = True
+            return (job, True, data)
+        started = (lambda: on_start(job)) if on_start else None
+        # These take a slot per batch themselves, so several batches of one job can run at once
+        if tuner and not isolate:
+            return (job, *submit_tuned(api_key, org_id, actions, tuner, journal, on_start=started))
+        if not (synchronous or isolate):
+            return (job, *run_async_batches(api_key, org_id, chunk_actions(actions, False, size), journal, on_start=started))
+        with slots:
+            if started:
+                started()
+            if isolate and tuner:
+                # Isolation does its own resubmissions, so the tuner picks the size and mode and sees the overall outcome
+                mode = tuner.synchronous
+                started = time.monotonic()
+                (ok, data) = submit_isolating(api_key, org_id, actions, mode, tuner.size(mode), journal)
+                tuner.observe(len(actions), mode, time.monotonic() - started, not ok)
+                return (job, ok, data)
+            if isolate:
+                return (job, *submit_isolating(api_key, org_id, actions, synchronous, size, journal))
+            return (job, *create_action_batch(api_key, org_id, True, synchronous, actions, size, journal))
+
+    with ThreadPoolExecutor(max_workers=max_workers or concurrency) as executor:
+        futures = [executor.submit(work, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
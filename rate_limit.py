@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import email.utils
+import re
+import threading
+import time
+
+# Dashboard API budget per organization: a steady rate, plus a short burst
+rate = 5
+burst = 10
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# Network ID / device serial -> org ID, so that network- and device-scoped calls count against their organization
+_network_orgs = {}
+_device_orgs = {}
+
+_org_pattern = re.compile(r'/organizations/([^/?#]+)')
+_network_pattern = re.compile(r'/networks/([^/?#]+)')
+_device_pattern = re.compile(r'/devices/([^/?#]+)')
+
+
+# Token bucket shared by every caller that uses the same key (normally an org ID)
+class TokenBucket:
+    def __init__(self, rate=rate, burst=burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    # Block until a request may be sent. Tokens may go negative, which queues callers in order.
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = max(-self.tokens / self.rate, self.paused_until - now)
+        if wait > 0:
+            time.sleep(wait)
+
+    # Hold every caller for the given number of seconds, e.g. after a 429 response
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0)
+
+
+# Return the shared limiter for this key, creating it on first use
+def get_limiter(key):
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(key, TokenBucket(rate, burst))
+    return limiter
+
+
+# Record which organization a network belongs to
+def bind_network(net_id, org_id):
+    _network_orgs[net_id] = org_id
+
+
+# Record which organization a device belongs to
+def bind_device(serial, org_id):
+    _device_orgs[serial] = org_id
+
+
+# The org ID a request URL counts against, or None if it can't be determined
+def org_for_url(url):
+    match = _org_pattern.search(url)
+    if match:
+        return match.group(1)
+    match = _network_pattern.search(url)
+    if match and match.group(1) in _network_orgs:
+        return _network_orgs[match.group(1)]
+    match = _device_pattern.search(url)
+    if match:
+        return _device_orgs.get(match.group(1))
+    return None
+
+
+# Limiter for a request URL, falling back to a per-API-key limiter when the org is unknown
+def limiter_for(url, api_key):
+    org_id = org_for_url(url)
+    return get_limiter(('org', org_id) if org_id else ('key', api_key))
+
+
+# Seconds to wait before retrying a 429 response, from its Retry-After header if present
+def retry_after(response, attempt):
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            pass
+    return min(2 ** attempt, 60)
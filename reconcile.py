@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# Diff desired actions against live configuration, so that only actions that change something are submitted.
+#
+# Live state is fetched one collection at a time (all devices in the org, all VLANs / group policies of a network,
+# all switch ports of a switch) rather than one GET per resource, and cached in a LiveState shared across sites.
+
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
+
+from dashboard import get_group_policies, get_management_interface, get_org_devices, get_switchports, get_vlans
+from payloads import RawJSON
+
+_device = re.compile(r'/networks/([^/]+)/devices/([^/]+)$')
+_management = re.compile(r'/networks/([^/]+)/devices/([^/]+)/managementInterfaceSettings$')
+_vlans = re.compile(r'/networks/([^/]+)/vlans(?:/[^/]+)?$')
+_policies = re.compile(r'/networks/([^/]+)/groupPolicies(?:/[^/]+)?$')
+_switchports = re.compile(r'/devices/([^/]+)/switchPorts/[^/]+$')
+
+
+# Current configuration, keyed by resource path, plus which collections have been fully listed
+class LiveState:
+    def __init__(self):
+        self.resources = {}
+        self.collections = set()
+        self.policy_ids = {}  # (net_id, policy name) -> groupPolicyId
+        self.lock = threading.Lock()
+        self.org_lock = threading.Lock()
+
+    def add(self, resource, body):
+        with self.lock:
+            self.resources[resource] = body
+
+    def listed(self, collection):
+        with self.lock:
+            self.collections.add(collection)
+
+    def has(self, collection):
+        with self.lock:
+            return collection in self.collections
+
+
+def _fetch_devices(api_key, org_id, live):
+    (ok, devices) = get_org_devices(api_key, org_id)
+    if ok:
+        for device in devices:
+            live.add(f'/networks/{device.get("networkId")}/devices/{device["serial"]}', device)
+        live.listed(f'/organizations/{org_id}/devices')
+
+
+def _fetch_management(api_key, net_id, serial, live):
+    (ok, data) = get_management_interface(api_key, net_id, serial)
+    if ok:
+        live.add(f'/networks/{net_id}/devices/{serial}/managementInterfaceSettings', data)
+
+
+def _fetch_vlans(api_key, net_id, live):
+    (ok, vlans) = get_vlans(api_key, net_id)
+    if ok:
+        for vlan in vlans:
+            live.add(f'/networks/{net_id}/vlans/{vlan["id"]}', vlan)
+        live.listed(f'/networks/{net_id}/vlans')
+
+
+def _fetch_policies(api_key, net_id, live):
+    (ok, policies) = get_group_policies(api_key, net_id)
+    if ok:
+        for policy in policies:
+            live.add(f'/networks/{net_id}/groupPolicies/{policy["groupPolicyId"]}', policy)
+            with live.lock:
+                live.policy_ids[(net_id, policy['name'])] = policy['groupPolicyId']
+        live.listed(f'/networks/{net_id}/groupPolicies')
+
+
+def _fetch_switchports(api_key, serial, live):
+    (ok, ports) = get_switchports(api_key, serial)
+    if ok:
+        for port in ports:
+            live.add(f'/devices/{serial}/switchPorts/{port["number"]}', port)
+        live.listed(f'/devices/{serial}/switchPorts')
+
+
+# Fetch the live state of everything the given actions touch that isn't in live yet, max_workers calls at a time
+def fetch_current(api_key, org_id, actions, live=None, max_workers=5):
+    live = live or LiveState()
+    fetches = {}
+    org_devices = False
+    for action in actions:
+        resource = action['resource']
+        if _device.match(resource):
+            org_devices = True
+        elif _management.match(resource):
+            (net_id, serial) = _management.match(resource).groups()
+            fetches[resource] = (_fetch_management, api_key, net_id, serial, live)
+        elif _vlans.match(resource):
+            net_id = _vlans.match(resource).group(1)
+            fetches[f'/networks/{net_id}/vlans'] = (_fetch_vlans, api_key, net_id, live)
+        elif _policies.match(resource):
+            net_id = _policies.match(resource).group(1)
+            fetches[f'/networks/{net_id}/groupPolicies'] = (_fetch_policies, api_key, net_id, live)
+        elif _switchports.match(resource):
+            serial = _switchports.match(resource).group(1)
+            fetches[f'/devices/{serial}/switchPorts'] = (_fetch_switchports, api_key, serial, live)
+
+    # The org-wide device listing is shared by every site, so only the first caller fetches it
+    if org_devices:
+        with live.org_lock:
+            if not live.has(f'/organizations/{org_id}/devices'):
+                _fetch_devices(api_key, org_id, live)
+
+    todo = [fetch for (key, fetch) in fetches.items() if not live.has(key) and key not in live.resources]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [executor.submit(*fetch) for fetch in todo]:
+            future.result()
+    return live
+
+
+# Normalize values that the API represents in more than one way
+def _normalize(key, value):
+    if key == 'tags':
+        return sorted(value.split() if isinstance(value, str) else value or [])
+    if value == '':
+        return None
+    return value
+
+
+# Whether applying desired on top of current would change anything. Fields absent from current
+# (write-only ones like moveMapMarker) can't be compared and are ignored.
+def differs(desired, current):
+    if isinstance(desired, RawJSON):
+        desired = desired.value
+    for (key, value) in desired.items():
+        if key not in current:
+            continue
+        if isinstance(value, dict) and isinstance(current[key], dict):
+            if differs(value, current[key]):
+                return True
+        elif _normalize(key, value) != _normalize(key, current[key]):
+            return True
+    return False
+
+
+# The subset of actions that would change live configuration. Updates matching live state are dropped;
+# creates of resources that already exist (matched by VLAN ID or group policy name) are dropped if they match,
+# or turned into updates if not; destroys of resources that are already gone are dropped.
+def reconcile(actions, live):
+    needed = []
+    for action in actions:
+        resource = action['resource']
+        operation = action['operation']
+        body = action.get('body') or {}
+        if isinstance(body, RawJSON):
+            body = body.value
+
+        if operation == 'update':
+            current = live.resources.get(resource)
+            if current is not None and not differs(body, current):
+                continue
+        elif operation == 'create' and live.has(resource):
+            target = None
+            if 'id' in body:
+                target = f'{resource}/{body["id"]}'
+            elif _policies.match(resource) and body.get('name'):
+                policy_id = live.policy_ids.get((_policies.match(resource).group(1), body['name']))
+                target = f'{resource}/{policy_id}' if policy_id else None
+            current = live.resources.get(target) if target else None
+            if current is not None:
+                changes = {key: value for (key, value) in body.items() if key != 'id'}
+                if differs(changes, current):
+                    needed.append({'resource': target, 'operation': 'update', 'body': changes})
+                continue
+        elif operation == 'destroy':
+            collection = resource.rsplit('/', 1)[0]
+            if live.has(collection) and resource not in live.resources:
+                continue
+        needed.append(action)
+    return needed
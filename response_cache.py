@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Opt-in cache of read responses, keyed by API key and URL. Entries are served as-is for ttl seconds, then
+# revalidated with If-None-Match / If-Modified-Since where the server sent an ETag or Last-Modified, and the
+# least recently used entries are evicted beyond max_entries. Any write through DashboardClient invalidates
+# cached reads of the resource written, its collection and its subresources; action batches,
+# which can touch anything, invalidate everything cached for the API key.
+
+from collections import OrderedDict
+import threading
+import time
+from urllib.parse import urlsplit
+
+import rate_limit
+
+# The active cache, or None while caching is off
+cache = None
+
+
+class Entry:
+    __slots__ = ('response', 'expires')
+
+    def __init__(self, response, expires):
+        self.response = response
+        self.expires = expires
+
+    @property
+    def fresh(self):
+        return time.monotonic() < self.expires
+
+    # Headers that turn a refetch into a conditional request, if the server gave us validators
+    def validators(self):
+        headers = {}
+        if 'ETag' in self.response.headers:
+            headers['If-None-Match'] = self.response.headers['ETag']
+        if 'Last-Modified' in self.response.headers:
+            headers['If-Modified-Since'] = self.response.headers['Last-Modified']
+        return headers
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # (api_key, url) -> Entry, least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, response):
+        with self.lock:
+            self.entries[key] = Entry(response, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # Mark an entry current again after the server answered 304 Not Modified
+    def refresh(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry.expires = time.monotonic() + self.ttl
+
+    def clear(self, api_key=None):
+        with self.lock:
+            if api_key is None:
+                self.entries.clear()
+            else:
+                for key in [key for key in self.entries if key[0] == api_key]:
+                    del self.entries[key]
+
+    # Drop the cached reads that a write to url may have changed
+    def invalidate(self, api_key, url):
+        path = urlsplit(url).path.rstrip('/')
+        if '/actionBatches' in path:
+            self.clear(api_key)
+            return
+        paths = [path]
+        # A network's org listing changes when the network does
+        org_id = rate_limit.org_for_url(url) if '/networks/' in path else None
+        if org_id:
+            paths.append(f'{urlsplit(url).path.split("/networks/")[0]}/organizations/{org_id}/networks')
+        with self.lock:
+            for key in list(self.entries):
+                if key[0] != api_key:
+                    continue
+                cached = urlsplit(key[1]).path.rstrip('/')
+                if any(_related(cached, written) for written in paths):
+                    del self.entries[key]
+
+
+# Whether a cached path is the one written, lies beneath it, or is the collection it belongs to
+def _related(cached, written):
+    return cached == written or cached.startswith(written + '/') or cached == written.rsplit('/', 1)[0]
+
+
+# Turn caching on (replacing any existing cache) with the given bounds
+def enable(max_entries=256, ttl=60):
+    global cache
+    cache = ResponseCache(max_entries, ttl)
+    return cache
+
+
+def disable():
+    global cache
+    cache = None
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Dependency-aware task scheduler. Each task starts as soon as all of its own prerequisites have finished,
+# instead of waiting for a whole phase to finish everywhere, with at most max_workers tasks running at once.
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Task:
+    __slots__ = ('name', 'func', 'deps', 'dependents', 'waiting', 'ok', 'data')
+
+    def __init__(self, name, func, deps):
+        self.name = name
+        self.func = func  # called with no arguments, returns (ok, data)
+        self.deps = tuple(deps)
+        self.dependents = []
+        self.waiting = len(self.deps)
+        self.ok = None
+        self.data = None
+
+
+class Scheduler:
+    def __init__(self, max_workers=10, on_done=None):
+        self.max_workers = max_workers
+        self.on_done = on_done  # called with each finished Task, from the thread running run()
+        self.tasks = {}
+
+    # Add a task that runs func() once every task named in deps has succeeded. Returns its name.
+    def add(self, name, func, deps=()):
+        if name in self.tasks:
+            raise ValueError(f'Task {name} already exists')
+        missing = [dep for dep in deps if dep not in self.tasks]
+        if missing:
+            raise ValueError(f'Task {name} depends on unknown task(s) {", ".join(missing)}')
+        task = Task(name, func, deps)
+        for dep in task.deps:
+            self.tasks[dep].dependents.append(task)
+        self.tasks[name] = task
+        return name
+
+    def _run_task(self, task):
+        try:
+            return task.func()
+        except Exception as error:
+            return (False, repr(error))
+
+    # Mark a task and everything downstream of it as skipped, because a prerequisite failed
+    def _skip(self, task, reason):
+        task.ok = False
+        task.data = f'skipped, {reason} failed'
+        if self.on_done:
+            self.on_done(task)
+        for dependent in task.dependents:
+            if dependent.ok is None:
+                self._skip(dependent, reason)
+
+    # Run every task, returning {name: (ok, data)}. A failed task's dependents are skipped, not run.
+    def run(self):
+        # Newly unblocked tasks are taken first, so started chains finish before new ones begin
+        ready = [task for task in self.tasks.values() if task.waiting == 0][::-1]
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while ready or running:
+                while ready and len(running) < self.max_workers:
+                    task = ready.pop()
+                    running[executor.submit(self._run_task, task)] = task
+                (done, pending) = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    (task.ok, task.data) = future.result()
+                    if self.on_done:
+                        self.on_done(task)
+                    for dependent in task.dependents:
+                        if dependent.ok is not None:
+                            continue
+                        if not task.ok:
+                            self._skip(dependent, task.name)
+                            continue
+                        dependent.waiting -= 1
+                        if dependent.waiting == 0:
+                            ready.append(dependent)
+        return {name: (task.ok, task.data) for (name, task) in self.tasks.items()}
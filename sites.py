@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import csv
+
+
+# One row of inventory.csv
+class Site:
+    __slots__ = ('site', 'location', 'mx_serial', 'ms_serial', 'mr_serial', 'mv_serial', 'ms_ip', 'mr_ip', 'mgmt_vlan', 'address')
+
+    def __init__(self, site, location, mx_serial='', ms_serial='', mr_serial='', mv_serial='', ms_ip='', mr_ip='', mgmt_vlan=1, address=None):
+        self.site = site
+        self.location = location
+        self.mx_serial = mx_serial
+        self.ms_serial = ms_serial
+        self.mr_serial = mr_serial
+        self.mv_serial = mv_serial
+        self.ms_ip = ms_ip
+        self.mr_ip = mr_ip
+        self.mgmt_vlan = mgmt_vlan
+        self.address = address or location
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            row['Site'],
+            row['Location'],
+            row['MX device'],
+            row['MS device'],
+            row['MR device'],
+            row['MV device'],
+            row['MS IP'],
+            row['MR IP'],
+            int(row['Mgmt. VLAN']),
+            row.get('Address'),
+        )
+
+    # Name of the site's network, derived from its location
+    @property
+    def net_name(self):
+        return self.location.replace(',', ' -')
+
+    @property
+    def serials(self):
+        return (self.mx_serial, self.ms_serial, self.mr_serial, self.mv_serial)
+
+    # (serial, description) for each device slot, including empty ones
+    @property
+    def devices(self):
+        return [(self.mx_serial, 'SD-WAN UTM gateway'),
+                (self.ms_serial, 'Access switch'),
+                (self.mr_serial, 'Wireless AP'),
+                (self.mv_serial, 'Security camera')]
+
+    def __repr__(self):
+        return f'Site({self.site!r}, {self.location!r})'
+
+
+# All sites of an inventory, in file order and indexed by site ID
+class Inventory:
+    def __init__(self, sites):
+        self.sites = list(sites)
+        self.by_id = {site.site: site for site in self.sites}
+
+    def __iter__(self):
+        return iter(self.sites)
+
+    def __len__(self):
+        return len(self.sites)
+
+    def __getitem__(self, site_id):
+        return self.by_id[site_id]
+
+    def __contains__(self, site_id):
+        return site_id in self.by_id
+
+    def get(self, site_id, default=None):
+        return self.by_id.get(site_id, default)
+
+
+# Stream Site records from an inventory file one at a time, for inventories too large to hold in memory
+def iter_sites(path='inventory.csv'):
+    with open(path, newline='\n', encoding='utf-8-sig') as csvfile:
+        reader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
+        for row in reader:
+            yield Site.from_row(row)
+
+
+# Parse an inventory file once into an Inventory
+def load_inventory(path='inventory.csv'):
+    return Inventory(iter_sites(path))
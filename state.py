@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Durable record of provisioning progress, written as each piece of work finishes, so that
+# a rerun after a crash skips what was already done. Backed by SQLite in WAL mode.
+
+import sqlite3
+import threading
+import time
+
+schema = '''
+CREATE TABLE IF NOT EXISTS networks (
+    site TEXT PRIMARY KEY,
+    location TEXT,
+    net_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS devices (
+    serial TEXT PRIMARY KEY,
+    net_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    site TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    completed REAL NOT NULL,
+    PRIMARY KEY (site, stage)
+);
+'''
+
+
+class StateStore:
+    def __init__(self, path='provisioning.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(schema)
+
+    # Run one write in its own transaction, so it is durable as soon as this returns
+    def _write(self, sql, rows):
+        with self.lock, self.db:
+            self.db.executemany(sql, rows)
+
+    def _read(self, sql, args=()):
+        with self.lock:
+            return self.db.execute(sql, args).fetchall()
+
+    # Networks created for sites, in the order they were recorded
+
+    def record_network(self, site, location, net_id):
+        self._write('INSERT OR REPLACE INTO networks (site, location, net_id) VALUES (?, ?, ?)', [(site, location, net_id)])
+
+    def networks(self):
+        rows = self._read('SELECT site, location, net_id FROM networks ORDER BY rowid')
+        return [{'site': site, 'location': location, 'net_id': net_id} for (site, location, net_id) in rows]
+
+    def forget_network(self, site):
+        with self.lock, self.db:
+            row = self.db.execute('SELECT net_id FROM networks WHERE site = ?', (site,)).fetchone()
+            self.db.execute('DELETE FROM networks WHERE site = ?', (site,))
+            self.db.execute('DELETE FROM stages WHERE site = ?', (site,))
+            if row:
+                self.db.execute('DELETE FROM devices WHERE net_id = ?', row)
+
+    # Claimed devices
+
+    def record_claims(self, claims):
+        self._write('INSERT OR REPLACE INTO devices (serial, net_id) VALUES (?, ?)', list(claims))
+
+    def claimed(self):
+        return {serial for (serial,) in self._read('SELECT serial FROM devices')}
+
+    # Completed stages of work per site, e.g. 'devices' or 'settings'
+
+    def record_done(self, site, stage):
+        self._write('INSERT OR REPLACE INTO stages (site, stage, completed) VALUES (?, ?, ?)', [(site, stage, time.time())])
+
+    def done(self, stage):
+        return {site for (site,) in self._read('SELECT site FROM stages WHERE stage = ?', (stage,))}
+
+    def reset(self):
+        with self.lock, self.db:
+            for table in ('networks', 'devices', 'stages'):
+                self.db.execute(f'DELETE FROM {table}')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
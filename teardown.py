@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Bulk deletion of networks through destroy action batches: up to MAX_ACTIONS networks per asynchronous batch,
+# at most MAX_CONCURRENT_BATCHES batches in flight, and one poller tracking all of them.
+
+from fnmatch import fnmatchcase
+import time
+
+from action_batches import (MAX_CONCURRENT_BATCHES, backoff_delays, batch_slots, batch_state, chunk_actions,
+                            failed_indexes, poll_batches, post_action_batch)
+from dashboard import get_networks
+from network_index import network_tags
+
+
+# IDs of the networks in an org matching every given filter: a tag, and/or a name pattern like 'Site *'
+def select_networks(api_key, org_id, tag=None, name=None):
+    (ok, networks) = get_networks(api_key, org_id, per_page=1000, stream=True, fields=('id', 'name', 'tags'))
+    if not ok:
+        raise RuntimeError(networks)
+    return [network['id'] for network in networks
+            if (tag is None or tag in network_tags(network)) and (name is None or fnmatchcase(network['name'], name))]
+
+
+def _destroy(net_id):
+    return {'resource': f'/networks/{net_id}', 'operation': 'destroy', 'body': {}}
+
+
+# Delete the given networks, returning {net_id: (ok, errors)} once every batch has finished.
+# Atomic batches fail as a whole, so when a batch's errors blame particular networks by index,
+# only those are reported as failed and the rest are submitted again in a new batch.
+def teardown_networks(api_key, org_id, net_ids, size=None, journal=None, interval=1, max_interval=30, print_message=False):
+    todo = chunk_actions(dict.fromkeys(net_ids), False, size)  # lists of network IDs, one per batch
+    slots = batch_slots(org_id)
+    pending = {}  # batch ID -> network IDs in it
+    results = {}
+    delays = backoff_delays(interval, max_interval)
+
+    while todo or pending:
+        # Fill the free batch slots, only blocking for one when nothing of ours is in flight
+        while todo and len(pending) < MAX_CONCURRENT_BATCHES and slots.acquire(blocking=not pending):
+            chunk = todo.pop(0)
+            (ok, data) = post_action_batch(api_key, org_id, True, False, [_destroy(net_id) for net_id in chunk], journal)
+            if not ok:
+                slots.release()
+                results.update((net_id, (False, [data])) for net_id in chunk)
+            else:
+                pending[str(data['id'])] = chunk
+        if not pending:
+            continue
+
+        finished = poll_batches(api_key, org_id, pending)
+        for (batch_id, batch) in finished.items():
+            slots.release()
+            chunk = pending.pop(batch_id)
+            if batch_state(batch) == 1:
+                results.update((net_id, (True, [])) for net_id in chunk)
+                continue
+            blamed = failed_indexes(batch, len(chunk))
+            errors = batch['status']['errors']
+            if blamed:
+                results.update((chunk[i], (False, errors)) for i in blamed)
+                rest = [net_id for (i, net_id) in enumerate(chunk) if i not in blamed]
+                if rest:
+                    todo.append(rest)
+            else:
+                results.update((net_id, (False, errors)) for net_id in chunk)
+        if finished:
+            delays = backoff_delays(interval, max_interval)
+            if todo:
+                continue  # fill the freed slots before waiting
+        if pending:
+            delay = next(delays)
+            if print_message:
+                print(f'Action batch(es) {", ".join(pending)} processing, checking again in {delay:.1f}s...')
+            time.sleep(delay)
+    return results